@@ -0,0 +1,220 @@
+import asyncio
+import html
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Telegram: ~30 повідомлень/с на бота і ~20 повідомлень/хв в одну групу/канал
+GLOBAL_RATE = float(os.getenv("BROADCAST_RATE", 30))
+CHAT_RATE = float(os.getenv("BROADCAST_CHAT_RATE", 20 / 60))
+CHAT_BURST = float(os.getenv("BROADCAST_CHAT_BURST", 3))
+CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 20))
+MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", 5))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1):
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+class RateLimiter:
+    """Глобальний ліміт бота + окремий ліміт і пауза (retry_after) для кожного чату."""
+
+    def __init__(
+        self,
+        rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+    ):
+        self.bucket = TokenBucket(rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats: dict[int, TokenBucket] = {}
+        self.paused_until: dict[int, float] = {}
+        # Відро, що простояло довше повного поповнення, рівнозначне новому — його можна викинути
+        self.idle_after = chat_burst / chat_rate if chat_rate else 60.0
+        self.swept = time.monotonic()
+
+    def pause(self, chat_id: int, seconds: float):
+        until = time.monotonic() + seconds
+        self.paused_until[chat_id] = max(self.paused_until.get(chat_id, 0), until)
+
+    async def wait_ready(self, chat_id: int):
+        # Нова пауза може прийти, поки спимо, тож перевіряємо дедлайн ще раз після сну
+        while True:
+            until = self.paused_until.get(chat_id)
+            if until is None:
+                return
+            delay = until - time.monotonic()
+            if delay <= 0:
+                self.paused_until.pop(chat_id, None)
+                return
+            await asyncio.sleep(delay)
+
+    def _sweep(self, now: float):
+        if now - self.swept < self.idle_after:
+            return
+        self.swept = now
+        for chat_id, bucket in list(self.chats.items()):
+            if now - bucket.updated > self.idle_after and not bucket.lock.locked():
+                del self.chats[chat_id]
+        for chat_id, until in list(self.paused_until.items()):
+            if until <= now:
+                del self.paused_until[chat_id]
+
+    async def acquire_chat(self, chat_id: int, cost: float = 1):
+        self._sweep(time.monotonic())
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        await bucket.acquire(cost)
+
+    async def acquire_global(self, cost: float = 1):
+        await self.bucket.acquire(cost)
+
+    async def acquire(self, chat_id: int, cost: float = 1):
+        await self.acquire_chat(chat_id, cost)
+        await self.acquire_global(cost)
+
+
+limiter = RateLimiter()
+
+
+@dataclass
+class DeliveryResult:
+    chat_id: int
+    ok: bool = False
+    attempts: int = 0
+    error: Optional[str] = None
+    retryable: bool = False
+    retry_after: Optional[float] = None
+    result: Any = None
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        limiter: RateLimiter = limiter,
+        concurrency: int = CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_retries = max_retries
+
+    async def deliver(
+        self, chat_id: int, send: Callable[[int], Awaitable[Any]], cost: float = 1
+    ) -> DeliveryResult:
+        delivery = DeliveryResult(chat_id=chat_id)
+
+        while delivery.attempts <= self.max_retries:
+            # retry_after і ліміт чату чекаємо поза семафором, щоб повільний чат не займав слот
+            await self.limiter.wait_ready(chat_id)
+            await self.limiter.acquire_chat(chat_id, cost)
+
+            async with self.semaphore:
+                await self.limiter.acquire_global(cost)
+                delivery.attempts += 1
+                try:
+                    delivery.result = await send(chat_id)
+                    delivery.ok = True
+                    delivery.error = None
+                    return delivery
+                except TelegramRetryAfter as e:
+                    self.limiter.pause(chat_id, e.retry_after)
+                    delivery.error = f"Flood control, retry after {e.retry_after}s"
+                    delivery.retryable = True
+                    delivery.retry_after = e.retry_after
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    delivery.error = e.message
+                    delivery.retryable = True
+                    return delivery
+                except TelegramAPIError as e:
+                    delivery.error = e.message
+                    delivery.retryable = False
+                    return delivery
+                except Exception as e:
+                    delivery.error = str(e)
+                    delivery.retryable = True
+                    return delivery
+
+        return delivery
+
+    async def run(
+        self,
+        chat_ids: Iterable[int],
+        send: Callable[[int], Awaitable[Any]],
+        on_progress: Optional[Callable[[int, int], Awaitable[Any]]] = None,
+        cost: float = 1,
+    ) -> list[DeliveryResult]:
+        chat_ids = list(chat_ids)
+        total = len(chat_ids)
+        done = 0
+
+        async def worker(chat_id: int) -> DeliveryResult:
+            nonlocal done
+            try:
+                return await self.deliver(chat_id, send, cost)
+            finally:
+                done += 1
+                if on_progress:
+                    await on_progress(done, total)
+
+        return await asyncio.gather(*(worker(chat_id) for chat_id in chat_ids))
+
+
+def throttled(callback: Callable[[int, int], Awaitable[Any]], interval: float = 1.0):
+    """Обгортка для on_progress: не частіше ніж раз на interval (окрім останнього виклику)."""
+    last = 0.0
+
+    async def wrapper(done: int, total: int):
+        nonlocal last
+        now = time.monotonic()
+        if done < total and now - last < interval:
+            return
+        last = now
+        await callback(done, total)
+
+    return wrapper
+
+
+def format_summary(
+    total: int, failed: list[tuple[int, Optional[str]]], title: str = "Повідомлення надіслані"
+) -> str:
+    """Підсумок за кількістю: надіслано total - len(failed), помилки — (chat_id, текст)."""
+    lines = [f"{title}: {total - len(failed)}/{total}"]
+
+    for chat_id, error in failed:
+        lines.append(f"❌ {chat_id}: {html.escape(error or '')}")
+
+    return "\n".join(lines)
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from app.utils import normalize_currency
+
+load_dotenv()
+
+
+ADMIN_TTL = float(os.getenv("ADMIN_CACHE_TTL", 300))
+ADMIN_NEGATIVE_TTL = float(os.getenv("ADMIN_CACHE_NEGATIVE_TTL", 30))
+ADMIN_CACHE_SIZE = int(os.getenv("ADMIN_CACHE_SIZE", 10000))
+
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    id: int
+    currency: str
+    rate: float
+
+
+class RateCache:
+    """Знімок таблиці rates у пам'яті процесу. version росте при кожній зміні."""
+
+    def __init__(self):
+        self.rates: dict[int, RateSnapshot] = {}
+        self.ordered: tuple[RateSnapshot, ...] = ()
+        # ISO-код -> курс; валюти з кількома рядками (напр. два курси USD) сюди не потрапляють
+        self.currency_rates: dict[str, float] = {}
+        self.version = 0
+
+    def _changed(self):
+        self.ordered = tuple(self.rates[rate_id] for rate_id in sorted(self.rates))
+
+        currency_rates = {}
+        ambiguous = set()
+        for rate in self.ordered:
+            code = normalize_currency(rate.currency)
+            if code is None:
+                continue
+            if code in currency_rates:
+                ambiguous.add(code)
+            currency_rates[code] = rate.rate
+        for code in ambiguous:
+            del currency_rates[code]
+        self.currency_rates = currency_rates
+
+        self.version += 1
+
+    def load(self, rates: Iterable):
+        self.rates = {
+            rate.id: RateSnapshot(id=rate.id, currency=rate.currency, rate=rate.rate)
+            for rate in rates
+        }
+        self._changed()
+
+    def all(self) -> tuple[RateSnapshot, ...]:
+        return self.ordered
+
+    def get(self, rate_id: int) -> Optional[RateSnapshot]:
+        return self.rates.get(rate_id)
+
+    def rates_with(self, rate: RateSnapshot) -> dict[str, float]:
+        """Курси валют, де вибраний рядок перекриває курс своєї валюти.
+
+        Назва без ISO-коду (напр. "Курс") — доларовий курс: до мультивалютності бот
+        перераховував лише суми в $.
+        """
+        code = normalize_currency(rate.currency) or "USD"
+        return {**self.currency_rates, code: rate.rate}
+
+    def put(self, rate_id: int, currency: str, rate: float):
+        self.rates[rate_id] = RateSnapshot(id=rate_id, currency=currency, rate=float(rate))
+        self._changed()
+
+    def update(self, rate_id: int, rate: float):
+        old = self.rates.get(rate_id)
+        if old:
+            self.put(rate_id, old.currency, rate)
+
+    def remove(self, rate_id: int):
+        if self.rates.pop(rate_id, None):
+            self._changed()
+
+
+rate_cache = RateCache()
+
+
+class DataVersion:
+    """Лічильник змін таблиці без власного кешу — ключ для побудованих з неї відповідей."""
+
+    def __init__(self):
+        self.value = 0
+
+    def bump(self):
+        self.value += 1
+
+
+channels_version = DataVersion()
+
+
+class AdminCache:
+    """tg_id -> is_admin з TTL; не-адміни кешуються на коротший (негативний) TTL.
+
+    Repository.set_admin/remove_user скидають кеш після commit; зміни прапорця is_admin
+    напряму в БД діють після закінчення TTL.
+    """
+
+    def __init__(
+        self,
+        ttl: float = ADMIN_TTL,
+        negative_ttl: float = ADMIN_NEGATIVE_TTL,
+        max_size: int = ADMIN_CACHE_SIZE,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries: dict[int, tuple[bool, float]] = {}
+        self.pending: dict[int, asyncio.Future] = {}
+
+    def get(self, tg_id: int) -> Optional[bool]:
+        entry = self.entries.get(tg_id)
+        if entry is None:
+            return None
+
+        is_admin, expires = entry
+        if expires < time.monotonic():
+            del self.entries[tg_id]
+            return None
+        return is_admin
+
+    def set(self, tg_id: int, is_admin: bool):
+        if len(self.entries) >= self.max_size:
+            self.entries.pop(next(iter(self.entries)))
+
+        ttl = self.ttl if is_admin else self.negative_ttl
+        self.entries[tg_id] = (is_admin, time.monotonic() + ttl)
+
+    def invalidate(self, tg_id: Optional[int] = None):
+        if tg_id is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(tg_id, None)
+
+    async def get_or_load(
+        self, tg_id: int, loader: Callable[[int], Awaitable[Optional[bool]]]
+    ) -> bool:
+        cached = self.get(tg_id)
+        if cached is not None:
+            return cached
+
+        # Фото одного альбому приходять майже одночасно: один запит на всіх
+        future = self.pending.get(tg_id)
+        if future is None:
+            future = asyncio.ensure_future(loader(tg_id))
+            self.pending[tg_id] = future
+            future.add_done_callback(lambda _: self.pending.pop(tg_id, None))
+
+        is_admin = await asyncio.shield(future)
+        if is_admin is None:
+            return False
+
+        self.set(tg_id, is_admin)
+        return is_admin
+
+
+admin_cache = AdminCache()
@@ -6,4 +6,7 @@ private = [
     BotCommand(command='list', description='Список каналів'),
     BotCommand(command='add_channel', description='Додати канал'),
     BotCommand(command='remove_channel', description='Видалити канал'),
+    BotCommand(command='batch', description='Пакетна обробка альбомів'),
+    BotCommand(command='broadcasts', description='Останні розсилки'),
+    BotCommand(command='stats', description='Метрики бота'),
 ]
\ No newline at end of file
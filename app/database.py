@@ -1,5 +1,12 @@
+import asyncio
+import json
+import logging
 import os
-from sqlalchemy import Float, select, delete, update
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+from sqlalchemy import Float, ForeignKey, Text, UniqueConstraint, bindparam, event, inspect, select, delete, update, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from dotenv import load_dotenv
 from sqlalchemy import (
@@ -10,8 +17,13 @@ from sqlalchemy import (
     Boolean,
     BigInteger,
 )
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
+from app.cache import admin_cache, channels_version, rate_cache
+from app.metrics import instrument
+from app.utils import CHANNEL_ID_PATTERN
+
 
 #from .env file:
 # DB_LITE=sqlite+aiosqlite:///my_base.db
@@ -21,10 +33,86 @@ from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 load_dotenv()
 
-engine = create_async_engine(os.getenv('DB_URL'))
+logger = logging.getLogger(__name__)
+
+SQLITE_PRAGMAS = os.getenv("SQLITE_PRAGMAS", "1") == "1"
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", -64000))  # від'ємне = KiB
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH", 100))
+
+# PostgreSQL (asyncpg)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# 0 — вимкнути кеш prepared statements asyncpg (потрібно за pgbouncer у transaction mode)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 500))
+DB_AUTO_CREATE = os.getenv("DB_AUTO_CREATE", "1") == "1"
+
+
+def apply_sqlite_pragmas(engine):
+    # WAL: читачі не блокують записувача; NORMAL достатньо надійний для WAL
+    pragmas = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA temp_store=MEMORY",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={SQLITE_CACHE_SIZE}",
+    )
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def make_engine(url: str):
+    url = make_url(url)
+    if url.get_backend_name() != "postgresql":
+        return create_async_engine(url)
+
+    return create_async_engine(
+        url.update_query_dict(
+            {"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)}
+        ),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+
+engine = make_engine(os.getenv('DB_URL'))
+
+if engine.dialect.name == "sqlite" and SQLITE_PRAGMAS:
+    apply_sqlite_pragmas(engine)
+
+# SQLite має один замок на запис: тримаємо в процесі не більше однієї write-транзакції
+SERIALIZE_WRITES = engine.dialect.name == "sqlite"
 
 session_maker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
+background_tasks: set[asyncio.Task] = set()
+
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def insert_for(model):
+    # INSERT ... ON CONFLICT для поточного діалекту
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
 
 async def create_db():
     async with engine.begin() as conn:
@@ -49,209 +137,931 @@ class User(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     tg_id: Mapped[int] = mapped_column(BigInteger, unique=True)
-    name: Mapped[str] = mapped_column(String(255), nullable=True)
+    name: Mapped[str] = mapped_column(String(255), nullable=True, index=True)
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False)
 
 class Channel(Base):
     __tablename__ = "channels"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    channel_id: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    channel_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
 
 
 class Rate(Base):
     __tablename__ = "rates"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    currency: Mapped[str] = mapped_column(String(255), nullable=False)
+    currency: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
     rate: Mapped[float] = mapped_column(Float, nullable=False)
 
+
+def utcnow() -> datetime:
+    return datetime.utcnow()
+
+
+class FsmRecord(Base):
+    __tablename__ = "fsm"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    key: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    state: Mapped[str] = mapped_column(String(255), nullable=True)
+    data: Mapped[str] = mapped_column(Text, nullable=True)  # JSON
+    # Годинник застосунку, а не func.now(): get_stale_fsm порівнює з utcnow(), а now()
+    # на PostgreSQL — час сервера з його часовим поясом
+    updated: Mapped[datetime] = mapped_column(DateTime, default=utcnow, onupdate=utcnow)
+
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    key: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)  # JSON
+    report_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    report_message_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    reported: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class Outbox(Base):
+    __tablename__ = "outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    broadcast_id: Mapped[int] = mapped_column(ForeignKey("broadcasts.id"), index=True)
+    channel_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    idempotency_key: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    status: Mapped[str] = mapped_column(String(16), default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+
+
+class Delivery(Base):
+    """Журнал доставки: які повідомлення розсилки опинилися в якому каналі."""
+
+    __tablename__ = "deliveries"
+    __table_args__ = (UniqueConstraint("broadcast_id", "channel_id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    broadcast_id: Mapped[int] = mapped_column(ForeignKey("broadcasts.id"), index=True)
+    channel_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    message_ids: Mapped[str] = mapped_column(Text, nullable=False)  # JSON: [альбом..., тексти...]
+
+
+class ScheduledJob(Base):
+    """Пост, відкладений на певний час: у потрібний момент стає звичайною розсилкою."""
+
+    __tablename__ = "scheduled_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    run_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)  # UTC
+    payload: Mapped[str] = mapped_column(Text, nullable=False)  # JSON BroadcastPayload
+    report_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    status: Mapped[str] = mapped_column(String(16), default="pending", index=True)
+    broadcast_id: Mapped[int] = mapped_column(ForeignKey("broadcasts.id"), nullable=True)
+
+
 async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
 
-# ---------- ADD RATE ----------
-async def orm_add_rate(currency: str, rate: float):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                obj = Rate(currency=currency, rate=rate)
-                session.add(obj)
-                await session.commit()
-                return obj
-            except Exception as e:
-                print(e)
-                return None
+def _migrate_channel_ids(conn, table: str):
+    """channel_id VARCHAR -> BIGINT; рядки з некоректним ID видаляються."""
+    columns = {column["name"]: column for column in inspect(conn).get_columns(table)}
+    if not isinstance(columns["channel_id"]["type"], String):
+        return
 
-# ---------- GET RATE ----------
-async def orm_get_rate(rate_id: int):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = select(Rate).where(Rate.id == rate_id)
-                result = await session.execute(query)
-                return result.scalar()
-            except Exception as e:
-                print(e)
-                return None
+    rows = conn.execute(text(f"SELECT id, channel_id FROM {table}")).all()
+    invalid = [row.id for row in rows if not CHANNEL_ID_PATTERN.match(str(row.channel_id).strip())]
+    for row_id in invalid:
+        conn.execute(text(f"DELETE FROM {table} WHERE id = :id"), {"id": row_id})
+    if invalid:
+        logger.warning("Removed %s rows with invalid channel_id from %s", len(invalid), table)
 
-# ---------- GET ALL RATES ----------
-async def orm_get_rates():
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = select(Rate)
-                result = await session.execute(query)
-                return result.scalars().all()
-            except Exception as e:
-                print(e)
-                return None
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            text(
+                f"ALTER TABLE {table} ALTER COLUMN channel_id TYPE BIGINT "
+                "USING trim(channel_id)::bigint"
+            )
+        )
+        return
 
-# ---------- REMOVE RATE ----------
-async def orm_remove_rate(rate_id: int):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = delete(Rate).where(Rate.id == rate_id)
-                await session.execute(query)
-                await session.commit()
-                return True
-            except Exception as e:
-                print(e)
+    # SQLite не вміє ALTER COLUMN: перебудовуємо таблицю
+    model = Base.metadata.tables[table]
+    names = ", ".join(column.name for column in model.columns)
+    casts = {
+        "channel_id": "CAST(trim(channel_id) AS INTEGER)",
+        "created": "COALESCE(created, CURRENT_TIMESTAMP)",
+        "updated": "COALESCE(updated, CURRENT_TIMESTAMP)",
+    }
+    values = ", ".join(casts.get(column.name, column.name) for column in model.columns)
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_old"))
+    for index in model.indexes:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    model.create(conn)
+    conn.execute(text(f"INSERT INTO {table} ({names}) SELECT {values} FROM {table}_old"))
+    conn.execute(text(f"DROP TABLE {table}_old"))
+
+
+def _check_schema(conn) -> list[str]:
+    inspector = inspect(conn)
+    existing = set(inspector.get_table_names())
+    missing = [table for table in Base.metadata.sorted_tables if table.name not in existing]
+
+    if missing:
+        if not DB_AUTO_CREATE:
+            raise RuntimeError(
+                "Missing tables: " + ", ".join(table.name for table in missing)
+            )
+        Base.metadata.create_all(conn, tables=missing)
+
+    if "channels" in existing:
+        _migrate_channel_ids(conn, "channels")
+
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(conn, checkfirst=True)
+
+    return [table.name for table in missing]
+
+
+async def prepare_db():
+    """Перевірка схеми на старті: створює тільки відсутні таблиці/індекси та мігрує старі колонки."""
+    async with engine.begin() as conn:
+        created = await conn.run_sync(_check_schema)
+    if created:
+        logger.info("Created tables: %s", ", ".join(created))
+
+
+# Готові запити гарячого шляху: один раз зібрані, той самий SQL -> кеш prepared statements
+SELECT_RATES = select(Rate).order_by(Rate.id)
+SELECT_RATE = select(Rate).where(Rate.id == bindparam("rate_id"))
+SELECT_CHANNELS = select(Channel).order_by(Channel.id)
+SELECT_USER = select(User).where(User.tg_id == bindparam("tg_id"))
+SELECT_IS_ADMIN = select(User.is_admin).where(User.tg_id == bindparam("tg_id"))
+
+
+@instrument()
+class Repository:
+    """Усі запити до БД в межах однієї сесії (unit of work).
+
+    Транзакція стартує ліниво з першим запитом, фіксується один раз у commit().
+    Зміни кешів, що залежать від результату, виконуються тільки після commit.
+    На SQLite перший запис бере writer.lock до commit, тож хендлери фіксують зміни
+    до звернень до Bot API, щоб не блокувати пачки SingleWriter.
+    """
+
+    def __init__(self, session: AsyncSession, serialize_writes: bool = SERIALIZE_WRITES):
+        self.session = session
+        self.after_commit: list[Callable[[], Any]] = []
+        self.write_lock = writer.lock if serialize_writes else None
+        self.holds_lock = False
+        self.failed = False
+
+    async def _write(self):
+        if self.write_lock is not None and not self.holds_lock:
+            await self.write_lock.acquire()
+            self.holds_lock = True
+
+    def _release(self):
+        if self.holds_lock:
+            self.holds_lock = False
+            self.write_lock.release()
+
+    async def commit(self):
+        try:
+            if self.session.in_transaction():
+                await self.session.commit()
+        finally:
+            self._release()
+
+        callbacks, self.after_commit = self.after_commit, []
+        for callback in callbacks:
+            callback()
+
+    async def rollback(self):
+        self.failed = True
+        self.after_commit.clear()
+        try:
+            await self.session.rollback()
+        finally:
+            self._release()
+
+    # ---------- ADD RATE ----------
+    async def add_rate(self, currency: str, rate: float):
+        await self._write()
+        try:
+            obj = Rate(currency=currency, rate=rate)
+            self.session.add(obj)
+            await self.session.flush()
+            self.after_commit.append(lambda: rate_cache.put(obj.id, obj.currency, obj.rate))
+            return obj
+        except Exception:
+            logger.exception("Repository.add_rate failed")
+            await self.rollback()
+            return None
+
+    # ---------- GET RATE ----------
+    async def get_rate(self, rate_id: int):
+        try:
+            result = await self.session.execute(SELECT_RATE, {"rate_id": rate_id})
+            return result.scalar()
+        except Exception:
+            logger.exception("Repository.get_rate failed")
+            return None
+
+    # ---------- GET ALL RATES ----------
+    async def get_rates(self):
+        try:
+            result = await self.session.execute(SELECT_RATES)
+            return result.scalars().all()
+        except Exception:
+            logger.exception("Repository.get_rates failed")
+            return None
+
+    # ---------- REMOVE RATE ----------
+    async def remove_rate(self, rate_id: int):
+        await self._write()
+        try:
+            query = delete(Rate).where(Rate.id == rate_id)
+            await self.session.execute(query)
+            self.after_commit.append(lambda: rate_cache.remove(rate_id))
+            return True
+        except Exception:
+            logger.exception("Repository.remove_rate failed")
+            await self.rollback()
+            return None
+
+    # ---------- UPDATE RATE ----------
+    async def update_rate(self, rate_id: int, rate: float):
+        await self._write()
+        try:
+            query = update(Rate).where(Rate.id == rate_id).values(rate=rate)
+            await self.session.execute(query)
+            self.after_commit.append(lambda: rate_cache.update(rate_id, rate))
+            return True
+        except Exception:
+            logger.exception("Repository.update_rate failed")
+            await self.rollback()
+            return None
+
+    # ---------- ADD USER BY ID ----------
+    async def add_user(self, tg_id: int, name: str = None):
+        return await self.upsert_user(tg_id, name)
+
+    # ---------- ADD USER BY NAME ----------
+    async def add_user_by_name(self, name: str):
+        await self._write()
+        try:
+            obj = User(name=name)
+            self.session.add(obj)
+            await self.session.flush()
+            return obj
+        except Exception:
+            logger.exception("Repository.add_user_by_name failed")
+            await self.rollback()
+            return None
+
+    # ---------- REMOVE USER ----------
+    async def remove_user(self, name: str):
+        await self._write()
+        try:
+            query = delete(User).where(User.name == name)
+            result = await self.session.execute(query)
+            self.after_commit.append(admin_cache.invalidate)
+            return result.rowcount > 0
+        except Exception:
+            logger.exception("Repository.remove_user failed")
+            await self.rollback()
+            return None
+
+    # ---------- GET USER ----------
+    async def get_user(self, tg_id: int):
+        try:
+            result = await self.session.execute(SELECT_USER, {"tg_id": tg_id})
+            return result.scalar()
+        except Exception:
+            logger.exception("Repository.get_user failed")
+            return None
+
+    # ---------- GET USERS ----------
+    async def get_users(self):
+        try:
+            query = select(User)
+            result = await self.session.execute(query)
+            return result.scalars().all()
+        except Exception:
+            logger.exception("Repository.get_users failed")
+            return None
+
+    # ---------- IS ADMIN ----------
+    async def is_admin(self, tg_id: int, name: str = None):
+        try:
+            result = await self.session.execute(SELECT_IS_ADMIN, {"tg_id": tg_id})
+            is_admin = result.scalar()
+        except Exception:
+            logger.exception("Repository.is_admin failed")
+            return None
+
+        if is_admin is None:
+            # Реєструємо нового користувача у фоні, окремою сесією
+            run_in_background(register_user(tg_id, name))
+            return False
+
+        return is_admin
+
+    # ---------- UPSERT USER ----------
+    async def upsert_user(self, tg_id: int, name: str = None):
+        await self._write()
+        try:
+            query = (
+                insert_for(User)
+                .values(tg_id=tg_id, name=name)
+                .on_conflict_do_nothing(index_elements=[User.tg_id])
+            )
+            await self.session.execute(query)
+            return True
+        except Exception:
+            logger.exception("Repository.upsert_user failed")
+            await self.rollback()
+            return None
+
+    # ---------- SET ADMIN ----------
+    async def set_admin(self, tg_id: int, is_admin: bool):
+        await self._write()
+        try:
+            query = update(User).where(User.tg_id == tg_id).values(is_admin=is_admin)
+            result = await self.session.execute(query)
+            self.after_commit.append(lambda: admin_cache.invalidate(tg_id))
+            return result.rowcount > 0
+        except Exception:
+            logger.exception("Repository.set_admin failed")
+            await self.rollback()
+            return None
+
+    # ---------- ADD CHANNELS ----------
+    async def add_channels(self, channel_ids: list[int]):
+        """Один INSERT ... ON CONFLICT DO NOTHING; повертає ID, яких ще не було."""
+        if not channel_ids:
+            return []
+        await self._write()
+        try:
+            query = (
+                insert_for(Channel)
+                .values([{"channel_id": channel_id} for channel_id in dict.fromkeys(channel_ids)])
+                .on_conflict_do_nothing(index_elements=[Channel.channel_id])
+                .returning(Channel.channel_id)
+            )
+            result = await self.session.execute(query)
+            self.after_commit.append(channels_version.bump)
+            return list(result.scalars().all())
+        except Exception:
+            logger.exception("Repository.add_channels failed")
+            await self.rollback()
+            return None
+
+    # ---------- REMOVE CHANNELS ----------
+    async def remove_channels(self, channel_ids: list[int]):
+        """Один DELETE ... WHERE IN; повертає ID, які були видалені."""
+        if not channel_ids:
+            return []
+        await self._write()
+        try:
+            query = (
+                delete(Channel)
+                .where(Channel.channel_id.in_(channel_ids))
+                .returning(Channel.channel_id)
+            )
+            result = await self.session.execute(query)
+            self.after_commit.append(channels_version.bump)
+            return list(result.scalars().all())
+        except Exception:
+            logger.exception("Repository.remove_channels failed")
+            await self.rollback()
+            return None
+
+    # ---------- GET ALL CHANNELS ----------
+    async def get_channels(self):
+        try:
+            result = await self.session.execute(SELECT_CHANNELS)
+            return result.scalars().all()
+        except Exception:
+            logger.exception("Repository.get_channels failed")
+            return None
+
+    # ---------- CREATE BROADCAST ----------
+    async def create_broadcast(
+        self,
+        key: str,
+        payload: str,
+        channel_ids: list[int],
+        report_chat_id: int = None,
+        report_message_id: int = None,
+    ):
+        await self._write()
+        try:
+            query = select(Broadcast.id).where(Broadcast.key == key)
+            if (await self.session.execute(query)).scalar():
                 return None
 
-# ---------- UPDATE RATE ----------
-async def orm_update_rate(rate_id: int, rate: float):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = update(Rate).where(Rate.id == rate_id).values(rate=rate)
-                await session.execute(query)
-                await session.commit()
-                return True
-            except Exception as e:
-                print(e)
+            broadcast = Broadcast(
+                key=key,
+                payload=payload,
+                report_chat_id=report_chat_id,
+                report_message_id=report_message_id,
+            )
+            self.session.add(broadcast)
+            await self.session.flush()
+
+            for channel_id in dict.fromkeys(channel_ids):
+                self.session.add(
+                    Outbox(
+                        broadcast_id=broadcast.id,
+                        channel_id=channel_id,
+                        idempotency_key=f"{key}:{channel_id}",
+                    )
+                )
+            await self.session.flush()
+            return broadcast
+        except Exception:
+            logger.exception("Repository.create_broadcast failed")
+            await self.rollback()
+            return None
+
+    # ---------- GET BROADCAST ----------
+    async def get_broadcast(self, broadcast_id: int):
+        try:
+            query = select(Broadcast).where(Broadcast.id == broadcast_id)
+            result = await self.session.execute(query)
+            return result.scalar()
+        except Exception:
+            logger.exception("Repository.get_broadcast failed")
+            return None
+
+    # ---------- MARK BROADCAST REPORTED ----------
+    async def mark_broadcast_reported(self, broadcast_id: int):
+        await self._write()
+        try:
+            query = (
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.reported.is_(False))
+                .values(reported=True)
+            )
+            result = await self.session.execute(query)
+            return result.rowcount == 1
+        except Exception:
+            logger.exception("Repository.mark_broadcast_reported failed")
+            await self.rollback()
+            return False
+
+    # ---------- GET RECENT BROADCASTS ----------
+    async def get_recent_broadcasts(self, limit: int = 10):
+        try:
+            delivered = (
+                select(func.count(Delivery.id))
+                .where(Delivery.broadcast_id == Broadcast.id)
+                .scalar_subquery()
+            )
+            query = (
+                select(Broadcast, delivered)
+                .order_by(Broadcast.id.desc())
+                .limit(limit)
+            )
+            result = await self.session.execute(query)
+            return result.all()
+        except Exception:
+            logger.exception("Repository.get_recent_broadcasts failed")
+            return []
+
+    # ---------- UPDATE BROADCAST PAYLOAD ----------
+    async def update_broadcast_payload(self, broadcast_id: int, payload: str):
+        await self._write()
+        try:
+            query = (
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id)
+                .values(payload=payload)
+            )
+            await self.session.execute(query)
+            return True
+        except Exception:
+            logger.exception("Repository.update_broadcast_payload failed")
+            await self.rollback()
+            return None
+
+    # ---------- RECORD DELIVERY ----------
+    async def record_delivery(self, broadcast_id: int, channel_id: int, message_ids: list[int]):
+        await self._write()
+        try:
+            query = insert_for(Delivery).values(
+                broadcast_id=broadcast_id,
+                channel_id=channel_id,
+                message_ids=json.dumps(message_ids),
+            )
+            query = query.on_conflict_do_update(
+                index_elements=[Delivery.broadcast_id, Delivery.channel_id],
+                set_={"message_ids": query.excluded.message_ids, "updated": func.now()},
+            )
+            await self.session.execute(query)
+            return True
+        except Exception:
+            logger.exception("Repository.record_delivery failed")
+            await self.rollback()
+            return None
+
+    # ---------- GET DELIVERIES ----------
+    async def get_deliveries(self, broadcast_id: int):
+        try:
+            query = (
+                select(Delivery)
+                .where(Delivery.broadcast_id == broadcast_id)
+                .order_by(Delivery.id)
+            )
+            result = await self.session.execute(query)
+            return result.scalars().all()
+        except Exception:
+            logger.exception("Repository.get_deliveries failed")
+            return []
+
+    # ---------- GET DELIVERY ----------
+    async def get_delivery(self, broadcast_id: int, channel_id: int):
+        try:
+            query = select(Delivery).where(
+                Delivery.broadcast_id == broadcast_id, Delivery.channel_id == channel_id
+            )
+            result = await self.session.execute(query)
+            return result.scalar()
+        except Exception:
+            logger.exception("Repository.get_delivery failed")
+            return None
+
+    # ---------- REMOVE DELIVERIES ----------
+    async def remove_deliveries(self, broadcast_id: int, channel_ids: list[int]):
+        await self._write()
+        try:
+            query = delete(Delivery).where(
+                Delivery.broadcast_id == broadcast_id,
+                Delivery.channel_id.in_(channel_ids),
+            )
+            await self.session.execute(query)
+            return True
+        except Exception:
+            logger.exception("Repository.remove_deliveries failed")
+            await self.rollback()
+            return None
+
+    # ---------- CREATE SCHEDULED JOB ----------
+    async def create_scheduled_job(self, run_at: datetime, payload: str, report_chat_id: int = None):
+        await self._write()
+        try:
+            job = ScheduledJob(run_at=run_at, payload=payload, report_chat_id=report_chat_id)
+            self.session.add(job)
+            await self.session.flush()
+            return job
+        except Exception:
+            logger.exception("Repository.create_scheduled_job failed")
+            await self.rollback()
+            return None
+
+    # ---------- GET PENDING SCHEDULED JOBS ----------
+    async def get_pending_jobs(self):
+        try:
+            query = (
+                select(ScheduledJob)
+                .where(ScheduledJob.status == "pending")
+                .order_by(ScheduledJob.run_at)
+            )
+            result = await self.session.execute(query)
+            return result.scalars().all()
+        except Exception:
+            logger.exception("Repository.get_pending_jobs failed")
+            return []
+
+    # ---------- GET SCHEDULED JOB ----------
+    async def get_scheduled_job(self, job_id: int):
+        try:
+            query = select(ScheduledJob).where(ScheduledJob.id == job_id)
+            result = await self.session.execute(query)
+            return result.scalar()
+        except Exception:
+            logger.exception("Repository.get_scheduled_job failed")
+            return None
+
+    # ---------- START SCHEDULED JOB ----------
+    async def start_scheduled_job(self, job_id: int, report_message_id: int = None):
+        """Перетворює завдання на розсилку; повертає ID розсилки або None, якщо вже виконане."""
+        await self._write()
+        try:
+            job = await self.get_scheduled_job(job_id)
+            if not job or job.status != "pending":
                 return None
 
-# ---------- ADD USER BY ID ----------
-async def orm_add_user(tg_id: int, name: str = None):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                obj = User(tg_id=tg_id, name=name)
-                session.add(obj)
-                await session.commit()
-                return obj
-            except Exception as e:
-                print(e)
+            channels = await self.get_channels() or []
+            broadcast = await self.create_broadcast(
+                key=f"job:{job_id}",
+                payload=job.payload,
+                channel_ids=[channel.channel_id for channel in channels],
+                report_chat_id=job.report_chat_id,
+                report_message_id=report_message_id,
+            )
+            if not broadcast:
                 return None
 
+            job.status = "done"
+            job.broadcast_id = broadcast.id
+            await self.session.flush()
+            return broadcast.id
+        except Exception:
+            logger.exception("Repository.start_scheduled_job failed")
+            await self.rollback()
+            return None
 
-# ---------- ADD USER BY NAME ----------
-async def orm_add_user_by_name(name: str):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                obj = User(name=name)
-                session.add(obj)
-                await session.commit()
-                return obj
-            except Exception as e:
-                print(e)
-                return None
+    # ---------- FAIL SCHEDULED JOB ----------
+    async def fail_scheduled_job(self, job_id: int):
+        await self._write()
+        try:
+            query = (
+                update(ScheduledJob)
+                .where(ScheduledJob.id == job_id, ScheduledJob.status == "pending")
+                .values(status="failed")
+            )
+            result = await self.session.execute(query)
+            return result.rowcount == 1
+        except Exception:
+            logger.exception("Repository.fail_scheduled_job failed")
+            await self.rollback()
+            return None
 
+    # ---------- GET BROADCAST OUTBOX ----------
+    async def get_outbox(self, broadcast_id: int, status: str = None):
+        try:
+            query = (
+                select(Outbox)
+                .where(Outbox.broadcast_id == broadcast_id)
+                .order_by(Outbox.id)
+            )
+            if status is not None:
+                query = query.where(Outbox.status == status)
+            result = await self.session.execute(query)
+            return result.scalars().all()
+        except Exception:
+            logger.exception("Repository.get_outbox failed")
+            return []
 
-# ---------- REMOVE USER ----------
-async def orm_remove_user(name: str):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = delete(User).where(User.name == name)
-                await session.execute(query)
-                await session.commit()
-            except Exception as e:
-                print(e)
-                return None
+    # ---------- COUNT BROADCAST OUTBOX ----------
+    async def count_outbox(self, broadcast_id: int) -> dict[str, int]:
+        try:
+            query = (
+                select(Outbox.status, func.count())
+                .where(Outbox.broadcast_id == broadcast_id)
+                .group_by(Outbox.status)
+            )
+            result = await self.session.execute(query)
+            return {status: count for status, count in result.all()}
+        except Exception:
+            logger.exception("Repository.count_outbox failed")
+            return {}
 
+    @staticmethod
+    def _outbox_heads():
+        # FIFO на канал: у черзі бере участь лише найстаріший незавершений рядок каналу,
+        # тож поки він надсилається або чекає повтору, наступні пости цього каналу стоять
+        return (
+            select(func.min(Outbox.id))
+            .where(Outbox.status.in_(("pending", "sending")))
+            .group_by(Outbox.channel_id)
+        )
 
-# ---------- GET USER ----------
-async def orm_get_user(tg_id: int):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = select(User).where(User.tg_id == tg_id)
-                result = await session.execute(query)
-                return result.scalar()
-            except Exception as e:
-                print(e)
-                return None
+    # ---------- CLAIM DUE OUTBOX ROWS ----------
+    async def claim_outbox(self, limit: int):
+        await self._write()
+        try:
+            query = (
+                select(Outbox)
+                .where(
+                    Outbox.id.in_(self._outbox_heads()),
+                    Outbox.status == "pending",
+                    Outbox.next_attempt_at <= utcnow(),
+                )
+                .order_by(Outbox.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            rows = (await self.session.execute(query)).scalars().all()
+            for row in rows:
+                row.status = "sending"
+                row.attempts += 1
+            await self.session.flush()
+            return rows
+        except Exception:
+            logger.exception("Repository.claim_outbox failed")
+            await self.rollback()
+            return []
 
+    # ---------- NEXT OUTBOX DUE TIME ----------
+    async def next_outbox_due(self):
+        try:
+            query = select(func.min(Outbox.next_attempt_at)).where(
+                Outbox.id.in_(self._outbox_heads()), Outbox.status == "pending"
+            )
+            return (await self.session.execute(query)).scalar()
+        except Exception:
+            logger.exception("Repository.next_outbox_due failed")
+            return None
 
-# ---------- GET USERS ----------
-async def orm_get_users():
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = select(User)
-                result = await session.execute(query)
-                return result.scalars().all()
-            except Exception as e:
-                print(e)
-                return None
+    # ---------- FINISH OUTBOX ROW ----------
+    async def finish_outbox(self, outbox_id: int, status: str, error: str = None):
+        await self._write()
+        try:
+            query = (
+                update(Outbox)
+                .where(Outbox.id == outbox_id)
+                .values(status=status, error=error)
+            )
+            await self.session.execute(query)
+            return True
+        except Exception:
+            logger.exception("Repository.finish_outbox failed")
+            await self.rollback()
+            return None
 
+    # ---------- RETRY OUTBOX ROW ----------
+    async def retry_outbox(self, outbox_id: int, delay: float, error: str = None):
+        await self._write()
+        try:
+            query = (
+                update(Outbox)
+                .where(Outbox.id == outbox_id)
+                .values(
+                    status="pending",
+                    error=error,
+                    next_attempt_at=utcnow() + timedelta(seconds=delay),
+                )
+            )
+            await self.session.execute(query)
+            return True
+        except Exception:
+            logger.exception("Repository.retry_outbox failed")
+            await self.rollback()
+            return None
 
-# ---------- IS ADMIN ----------
-async def orm_is_admin(tg_id: int):
-    async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = select(User).where(User.tg_id == tg_id)
-                result = await session.execute(query)
-                user = result.scalar()
-                
-                if user:
-                    return user.is_admin
-                else:
-                    await orm_add_user(tg_id)
-                    return False
-            except:
-                return None
+    # ---------- RESET INTERRUPTED OUTBOX ROWS ----------
+    async def reset_outbox(self):
+        """Повертає в чергу рядки, що лишились у sending після падіння чи зупинки.
 
-# ---------- ADD CHANNEL ---------- 
-async def orm_add_channel(channel_id: str):
-    async with session_maker() as session:
-        async with session.begin():
+        Доставка at-least-once: воркер продовжує з кроків, яких ще немає в deliveries, але якщо
+        процес упав між відповіддю Telegram і цим записом, крок у канал піде повторно.
+        """
+        await self._write()
+        try:
+            query = (
+                update(Outbox)
+                .where(Outbox.status == "sending")
+                .values(status="pending")
+            )
+            await self.session.execute(query)
+            return True
+        except Exception:
+            logger.exception("Repository.reset_outbox failed")
+            await self.rollback()
+            return None
+
+    # ---------- GET FSM RECORD ----------
+    async def get_fsm(self, key: str):
+        query = select(FsmRecord).where(FsmRecord.key == key)
+        result = await self.session.execute(query)
+        return result.scalar()
+
+    # ---------- STALE FSM RECORDS ----------
+    async def get_stale_fsm(self, before: datetime, limit: int = 500):
+        query = select(FsmRecord).where(FsmRecord.updated < before).limit(limit)
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    # ---------- SAVE FSM RECORDS ----------
+    async def save_fsm(self, records: list[dict], deleted: list[str]):
+        await self._write()
+        if records:
+            query = insert_for(FsmRecord).values(records)
+            query = query.on_conflict_do_update(
+                index_elements=[FsmRecord.key],
+                set_={
+                    "state": query.excluded.state,
+                    "data": query.excluded.data,
+                    "updated": utcnow(),
+                },
+            )
+            await self.session.execute(query)
+        if deleted:
+            await self.session.execute(delete(FsmRecord).where(FsmRecord.key.in_(deleted)))
+        return True
+
+
+T = TypeVar("T")
+
+
+class SingleWriter:
+    """Одна фонова задача, що виконує записи пачками: одна транзакція і один commit на пачку.
+
+    Якщо пачка падає, операції повторюються поодинці, щоб помилка однієї не зачепила інших.
+    """
+
+    def __init__(self, session_pool: async_sessionmaker, max_batch: int = WRITE_BATCH_SIZE):
+        self.session_pool = session_pool
+        self.max_batch = max_batch
+        self.lock = asyncio.Lock()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+    async def submit(self, operation: Callable[[Repository], Awaitable[T]]) -> T:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((operation, future))
+        return await future
+
+    async def close(self):
+        if self.task is None or self.task.done():
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            async with self.lock:
+                await self._execute(batch)
+            if stop:
+                return
+
+    async def _execute(self, batch: list):
+        if len(batch) > 1:
             try:
-                obj = Channel(channel_id=channel_id)
-                session.add(obj)
-                await session.commit()
-                return obj
+                async with self.session_pool() as session:
+                    repo = Repository(session, serialize_writes=False)
+                    results = [await operation(repo) for operation, _ in batch]
+                    if not repo.failed:
+                        await repo.commit()
+                        for (_, future), result in zip(batch, results):
+                            if not future.done():
+                                future.set_result(result)
+                        return
             except Exception as e:
-                print(e)
-                return None
+                logger.warning("Write batch of %s failed, retrying one by one: %s", len(batch), e)
 
-# ---------- REMOVE CHANNEL ---------- 
-async def orm_remove_channel(channel_id: str):
-    async with session_maker() as session:
-        async with session.begin():
+        for operation, future in batch:
             try:
-                query = delete(Channel).where(Channel.channel_id == channel_id)
-                await session.execute(query)
-                await session.commit()
-                return True
+                async with self.session_pool() as session:
+                    repo = Repository(session, serialize_writes=False)
+                    result = await operation(repo)
+                    await repo.commit()
+                if not future.done():
+                    future.set_result(result)
             except Exception as e:
-                print(e)
-                return None
+                if not future.done():
+                    future.set_exception(e)
 
-# ---------- GET ALL CHANNELS ---------- 
-async def orm_get_channels():
+
+writer = SingleWriter(session_maker)
+
+
+@asynccontextmanager
+async def unit_of_work() -> AsyncIterator[Repository]:
+    """Окрема сесія для фонових задач (воркери, FSM, старт) з commit у кінці."""
     async with session_maker() as session:
-        async with session.begin():
-            try:
-                query = select(Channel)
-                result = await session.execute(query)
-                return result.scalars().all()
-            except Exception as e:
-                print(e)
-                return None
+        repo = Repository(session)
+        try:
+            yield repo
+            await repo.commit()
+        except BaseException:
+            await repo.rollback()
+            raise
+
+
+async def register_user(tg_id: int, name: str = None):
+    return await writer.submit(lambda repo: repo.upsert_user(tg_id, name))
+
+
+async def load_rate_cache():
+    async with unit_of_work() as repo:
+        rates = await repo.get_rates()
+    if rates is not None:
+        rate_cache.load(rates)
+    return rate_cache
@@ -0,0 +1,128 @@
+import html
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+
+from app.utils import get_highlighter
+
+logger = logging.getLogger(__name__)
+
+
+def _merge(spans: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[list[int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+@dataclass
+class Draft:
+    """Чернетка посту: простий текст по рядках + жирні проміжки в межах рядка.
+
+    HTML кожного рядка кешується і перераховується лише для змінених рядків.
+    """
+
+    media_group: list[str]
+    text: str  # оригінальний підпис, з якого рахуються ціни
+    lines: list[str] = field(default_factory=list)
+    bold: list[list[tuple[int, int]]] = field(default_factory=list)
+    line_number: Optional[int] = None
+    rendered: list[Optional[str]] = field(default_factory=list)
+
+    # ---------- STATE ----------
+
+    @classmethod
+    def load(cls, data: Optional[dict[str, Any]]) -> Optional["Draft"]:
+        if not data:
+            return None
+        return cls(
+            media_group=data["media"],
+            text=data["text"],
+            lines=data["lines"],
+            bold=[[tuple(span) for span in spans] for spans in data["bold"]],
+            line_number=data.get("line"),
+            rendered=data.get("html") or [None] * len(data["lines"]),
+        )
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            "media": self.media_group,
+            "text": self.text,
+            "lines": self.lines,
+            "bold": [[list(span) for span in spans] for spans in self.bold],
+            "line": self.line_number,
+            "html": self.rendered,
+        }
+
+    # ---------- EDITS ----------
+
+    def has_line(self, index: int) -> bool:
+        # Індекси приходять з кнопок, які могли лишитися від попередньої версії чернетки
+        return 0 <= index < len(self.lines)
+
+    def set_text(self, text: str):
+        self.lines = text.split("\n")
+        self.bold = [[] for _ in self.lines]
+        self.rendered = [None] * len(self.lines)
+
+    def insert_line(self, index: int, text: str = ""):
+        self.lines.insert(index, text)
+        self.bold.insert(index, [])
+        self.rendered.insert(index, None)
+
+    def add_bold(self, words: frozenset[str], line_number: Optional[int] = None):
+        highlighter = get_highlighter(words)
+        indexes = range(len(self.lines)) if line_number is None else [line_number]
+        for index in indexes:
+            spans = highlighter.spans(self.lines[index])
+            if spans:
+                self.bold[index] = _merge(self.bold[index] + spans)
+                self.rendered[index] = None
+
+    # ---------- RENDERING ----------
+
+    def line_html(self, index: int) -> str:
+        cached = self.rendered[index]
+        if cached is None:
+            line = self.lines[index]
+            out = []
+            last = 0
+            for start, end in self.bold[index]:
+                out.append(html.escape(line[last:start], quote=False))
+                out.append(f"<b>{html.escape(line[start:end], quote=False)}</b>")
+                last = end
+            out.append(html.escape(line[last:], quote=False))
+            cached = self.rendered[index] = "".join(out)
+        return cached
+
+    def html(self) -> str:
+        return "\n".join(self.line_html(index) for index in range(len(self.lines)))
+
+    def plain(self) -> str:
+        return "\n".join(self.lines)
+
+
+async def load_draft(state: FSMContext) -> Optional[Draft]:
+    return Draft.load(await state.get_value("draft"))
+
+
+async def save_draft(state: FSMContext, draft: Draft):
+    await state.set_data({"draft": draft.dump()})
+
+
+async def notify_expired(bot: Bot, key: StorageKey, data: dict[str, Any]):
+    """on_expire для SQLAlchemyStorage: повідомляє адміна, якщо прострочена чернетка чи пакет."""
+    if "draft" not in data and "batch" not in data:
+        return
+    try:
+        await bot.send_message(key.chat_id, "Чернетку видалено через неактивність")
+    except TelegramAPIError as e:
+        logger.warning("Draft expiry notice to %s failed: %s", key.chat_id, e)
@@ -1,12 +1,16 @@
 from aiogram.filters import Filter
 from aiogram.types import Message
 
-from app.database import orm_is_admin
+from app.cache import admin_cache
+from app.database import Repository
 
 
 class IsAdmin(Filter):
     def __init__(self) -> None:
         pass
 
-    async def __call__(self, message: Message):
-        return await orm_is_admin(message.from_user.id)
\ No newline at end of file
+    async def __call__(self, message: Message, repo: Repository):
+        user = message.from_user
+        return await admin_cache.get_or_load(
+            user.id, lambda tg_id: repo.is_admin(tg_id, user.username)
+        )
\ No newline at end of file
@@ -1,10 +1,17 @@
-import re
+import html
+import json
+import os
 import requests
-import app.database as rq
+from contextlib import suppress
+from dataclasses import replace
+from datetime import datetime, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
 
-from app.keyboards import get_callback_btns
+from app.keyboards import get_callback_btns, markup_cache
 
-from aiogram import Router, F, Bot
+from aiogram import Bot, Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery, InputMediaPhoto, InputMedia
 from aiogram.filters import CommandStart, StateFilter, Command
 from aiogram.fsm.context import FSMContext
@@ -12,15 +19,62 @@ from aiogram.fsm.state import State, StatesGroup
 
 from dotenv import load_dotenv
 
+from app.broadcast import Broadcaster, format_summary, throttled
+from app.cache import channels_version, rate_cache
+from app.database import Repository
+from app.draft import Draft, load_draft, save_draft
 from app.filters import IsAdmin
-from app.middlewares import AlbumMiddleware
-from app.utils import replace_prices_with_uah
+from app.metrics import registry
+from app.middlewares import AlbumMiddleware, MetricsMiddleware
+from app.outbox import OutboxWorker
+from app.scheduler import Scheduler
+from app.payload import (
+    MESSAGE_LIMIT,
+    BroadcastPayload,
+    PayloadError,
+    compile_payload,
+    plain_text,
+)
+from app.utils import (
+    PriceTemplate,
+    converter,
+    parse_channel_ids,
+    parse_schedule_time,
+    replace_prices_with_uah,
+    split_words,
+)
 
 load_dotenv()
 
+# Часовий пояс, у якому адмін вводить час відкладених постів
+SCHEDULE_TZ = ZoneInfo(os.getenv("SCHEDULE_TZ", "Europe/Kyiv"))
+
 router = Router()
 router.message.filter(IsAdmin())
-router.message.middleware(AlbumMiddleware())
+album_middleware = AlbumMiddleware()
+router.message.middleware(album_middleware)
+# Після альбомного: час хендлера без очікування решти частин альбому
+router.message.middleware(MetricsMiddleware())
+router.callback_query.middleware(MetricsMiddleware())
+
+registry.callback(
+    "bot_album_late_parts_total",
+    "Album parts that arrived after the album was handled",
+    lambda: album_middleware.stats.late_parts,
+    kind="counter",
+)
+registry.callback(
+    "bot_album_evicted_total",
+    "Albums evicted from the collector before completion",
+    lambda: album_middleware.stats.evicted,
+    kind="counter",
+)
+registry.callback(
+    "bot_album_expired_total",
+    "Stale album entries removed by the background sweep",
+    lambda: album_middleware.stats.expired,
+    kind="counter",
+)
 
 
 @router.message(CommandStart())
@@ -28,7 +82,61 @@ async def cmd_start(message: Message):
     await message.answer("Введіть повідомлення, яке потрібно конвертувати 👇")
 
 
-main_btns = {"Редагувати": "edit", "Надіслати в групи": "send_to_groups"}
+main_btns = {
+    "Редагувати": "edit",
+    "Надіслати в групи": "send_to_groups",
+    "Надіслати пізніше": "send_later",
+}
+
+# Статичні клавіатури будуються один раз
+main_kb = get_callback_btns(btns=main_btns)
+edit_kb = get_callback_btns(
+    btns={
+        "Добавити перехід на новий рядок": "add_line",
+        # "Видалити перехід на новий рядок": "remove_line",
+        "Виділити жирним": "add_bold",
+        "Назад": "back",
+    },
+    sizes=(1,),
+)
+
+
+def rates_menu_kb():
+    def build():
+        btns = {rate.currency: f"rate_{rate.id}" for rate in rate_cache.all()}
+        btns["Добавити валюту"] = "add_rate"
+        return get_callback_btns(btns=btns, sizes=(1,))
+
+    return markup_cache.get_or_build("rates_menu", rate_cache.version, build)
+
+
+def rate_info_kb(rate_id: int):
+    def build():
+        btns = {
+            "Змінити": f"edit_rate_{rate_id}",
+            "Видалити": f"delete_rate_{rate_id}",
+            "Назад": "back_rate",
+        }
+        return get_callback_btns(btns=btns)
+
+    return markup_cache.get_or_build(("rate_info", rate_id), 0, build)
+
+
+def select_rate_kb(template: PriceTemplate):
+    # Підписи кнопок залежать від цін у тексті, тому ключ — ще й набір сум і валют
+    def build():
+        btns = {}
+        for rate in rate_cache.all():
+            label = f"{rate.currency} - {rate.rate}"
+            if template.amounts:
+                preview = template.preview(None, rates=rate_cache.rates_with(rate))
+                label += f" → {preview} грн"
+            btns[label] = f"select_rate_{rate.id}"
+        return get_callback_btns(btns=btns)
+
+    return markup_cache.get_or_build(
+        ("select_rate", template.amounts, template.currencies), rate_cache.version, build
+    )
 
 
 class RateState(StatesGroup):
@@ -40,66 +148,47 @@ class RateState(StatesGroup):
 @router.message(Command("rate"))
 async def rate(message: Message, state: FSMContext):
     await state.clear()
-    rates = await rq.orm_get_rates()
-    btns = {}
-
-    if rates:
-        for rate in rates:
-            btns[rate.currency] = f"rate_{rate.id}"
-
-    btns["Добавити валюту"] = "add_rate"
-
-    await message.answer(
-        "Виберіть валюту 👇", reply_markup=get_callback_btns(btns=btns, sizes=(1,))
-    )
+    await message.answer("Виберіть валюту 👇", reply_markup=rates_menu_kb())
 
 
 @router.callback_query(F.data == "back_rate")
 async def back_rate(callback: CallbackQuery, state: FSMContext):
     await state.clear()
-    rates = await rq.orm_get_rates()
-    btns = {}
-
-    if rates:
-        for rate in rates:
-            btns[rate.currency] = f"rate_{rate.id}"
-
-    btns["Добавити валюту"] = "add_rate"
-
-    await callback.message.edit_text(
-        "Виберіть валюту 👇", reply_markup=get_callback_btns(btns=btns, sizes=(1,))
-    )
+    await callback.message.edit_text("Виберіть валюту 👇", reply_markup=rates_menu_kb())
 
 
 @router.callback_query(F.data.startswith("rate_"))
 async def rate_info(callback: CallbackQuery):
     rate_id = int(callback.data.split("_")[-1])
-    rate = await rq.orm_get_rate(rate_id)
+    rate = rate_cache.get(rate_id)
 
-    btns = {
-        "Змінити": f"edit_rate_{rate.id}",
-        "Видалити": f"delete_rate_{rate.id}",
-        "Назад": "back_rate",
-    }
+    if not rate:
+        await callback.answer("Валюту не знайдено")
+        return
 
     await callback.message.edit_text(
         f"Валюта {rate.currency}: {rate.rate}",
-        reply_markup=get_callback_btns(btns=btns),
+        reply_markup=rate_info_kb(rate.id),
     )
 
 
 @router.callback_query(F.data.startswith("delete_rate_"))
-async def delete_rate(callback: CallbackQuery, state: FSMContext):
+async def delete_rate(callback: CallbackQuery, state: FSMContext, repo: Repository):
     rate_id = int(callback.data.split("_")[-1])
-    await rq.orm_remove_rate(rate_id)
+    await repo.remove_rate(rate_id)
+    await repo.commit()
     await callback.answer("Валюта успішно видалена")
     await rate(callback.message, state)
 
 
 @router.callback_query(F.data.startswith("edit_rate_"))
-async def edit_rate(callback: CallbackQuery, state: FSMContext):
+async def ask_new_rate(callback: CallbackQuery, state: FSMContext):
     rate_id = int(callback.data.split("_")[-1])
-    rate = await rq.orm_get_rate(rate_id)
+    rate = rate_cache.get(rate_id)
+
+    if not rate:
+        await callback.answer("Валюту не знайдено")
+        return
 
     await callback.answer()
     await callback.message.answer(f"Введіть новий курс для {rate.currency} 👇")
@@ -108,13 +197,14 @@ async def edit_rate(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(RateState.edit_rate)
-async def edit_rate(message: Message, state: FSMContext):
+async def save_new_rate(message: Message, state: FSMContext, repo: Repository):
     try:
         data = await state.get_data()
         rate_id = data.get("rate_id")
         rate_price = float(message.text)
 
-        await rq.orm_update_rate(int(rate_id), rate_price)
+        await repo.update_rate(int(rate_id), rate_price)
+        await repo.commit()
 
         await message.answer("Курс успішно змінено")
         await state.clear()
@@ -139,13 +229,14 @@ async def add_rate_currency_first(message: Message, state: FSMContext):
 
 
 @router.message(RateState.add_rate)
-async def add_rate_currency_second(message: Message, state: FSMContext):
+async def add_rate_currency_second(message: Message, state: FSMContext, repo: Repository):
     try:
         data = await state.get_data()
         rate_name = data.get("rate_name")
         rate_price = float(message.text)
 
-        await rq.orm_add_rate(rate_name, rate_price)
+        await repo.add_rate(rate_name, rate_price)
+        await repo.commit()
 
         await message.answer("Курс успішно додано")
         await state.clear()
@@ -163,61 +254,453 @@ class ChannelIdState(StatesGroup):
 @router.message(
     Command("add_channel")
 )  # Фільтр, що реагує тільки на повідомлення з каналу
-async def save_channel_id(message: Message, state: FSMContext):
+async def add_channel(message: Message, state: FSMContext):
     await state.clear()
-    await message.answer("Введіть ID")
+    await message.answer("Введіть ID (можна декілька через пробіл, кому або з нового рядка)")
     await state.set_state(ChannelIdState.add_channel_id)
 
 
 @router.message(ChannelIdState.add_channel_id)
-async def save_channel_id(message: Message, state: FSMContext):
-    channel_id = message.text
-    result = await rq.orm_add_channel(channel_id)
+async def save_channel_id(message: Message, state: FSMContext, repo: Repository):
+    channel_ids, invalid = parse_channel_ids(message.text)
+    added = await repo.add_channels(channel_ids)
+    await repo.commit()
 
-    if result:
-        await message.answer("Канал успішно додано")
+    if added is None:
+        await message.answer("Помилка збереження каналів")
     else:
-        await message.answer("Канал вже існує")
+        existing = [channel_id for channel_id in channel_ids if channel_id not in added]
+        await message.answer(
+            format_channel_report(
+                "Канал успішно додано", added, "Канал вже існує", existing, invalid
+            )
+        )
 
     await state.clear()
 
 
 @router.message(Command("remove_channel"))
-async def remove_channel_id(message: Message, state: FSMContext):
+async def remove_channel(message: Message, state: FSMContext):
     await state.clear()
-    await message.answer("Введіть ID")
+    await message.answer("Введіть ID (можна декілька через пробіл, кому або з нового рядка)")
     await state.set_state(ChannelIdState.remove_channel_id)
 
 
 @router.message(ChannelIdState.remove_channel_id)
-async def remove_channel_id(message: Message, state: FSMContext):
-    channel_id = message.text
-    result = await rq.orm_remove_channel(channel_id)
+async def remove_channel_id(message: Message, state: FSMContext, repo: Repository):
+    channel_ids, invalid = parse_channel_ids(message.text)
+    removed = await repo.remove_channels(channel_ids)
+    await repo.commit()
 
-    if result:
-        await message.answer("Канал успішно видалено")
+    if removed is None:
+        await message.answer("Помилка видалення каналів")
     else:
-        await message.answer("Канал не знайдено")
+        missing = [channel_id for channel_id in channel_ids if channel_id not in removed]
+        await message.answer(
+            format_channel_report(
+                "Канал успішно видалено", removed, "Канал не знайдено", missing, invalid
+            )
+        )
 
     await state.clear()
 
 
+def format_channel_report(
+    done_title: str, done: list[int], skipped_title: str, skipped: list[int], invalid: list[str]
+) -> str:
+    lines = []
+    for title, ids in (
+        (done_title, done),
+        (skipped_title, skipped),
+        ("Некоректний ID", invalid),
+    ):
+        if ids:
+            lines.append(f"{title}: {', '.join(html.escape(str(i)) for i in ids)}")
+    return "\n".join(lines) or "ID не знайдено"
+
+
 @router.message(Command("list"))
-async def list_channels(message: Message, state: FSMContext):
+async def list_channels(message: Message, state: FSMContext, repo: Repository):
     await state.clear()
 
-    channels = await rq.orm_get_channels()
-    channels_str = ""
-
-    if channels:
-        for channel in channels:
-            channels_str += f"{channel.channel_id}\n"
-    else:
-        channels_str = "Канали не знайдено"
+    channels_str = markup_cache.get("channels_list", channels_version.value)
+    if channels_str is None:
+        channels = await repo.get_channels()
+        channels_str = "".join(f"{channel.channel_id}\n" for channel in channels or [])
+        channels_str = channels_str or "Канали не знайдено"
+        if channels is not None:
+            markup_cache.put("channels_list", channels_version.value, channels_str)
 
     await message.answer(channels_str)
 
 
+@router.message(Command("stats"))
+async def stats(message: Message, state: FSMContext):
+    await state.clear()
+    text = "\n".join(registry.summary()) or "Даних ще немає"
+    await message.answer(f"<pre>{html.escape(text[:4000])}</pre>")
+
+
+# ---------- SENT BROADCASTS ----------
+
+
+class BroadcastEditState(StatesGroup):
+    caption = State()
+
+
+async def run_on_deliveries(message: Message, channel_ids: list[int], send, title: str):
+    """Виконує дію в усіх каналах розсилки з тим самим лімітером, що й надсилання.
+
+    Викликається без відкритої транзакції: розсилка з лімітами триває довго.
+    """
+    status = await message.answer(f"{title}... 0/{len(channel_ids)}")
+
+    async def progress(done: int, total: int):
+        with suppress(TelegramBadRequest):
+            await status.edit_text(f"{title}... {done}/{total}")
+
+    results = await Broadcaster().run(channel_ids, send, on_progress=throttled(progress))
+    failed = [(result.chat_id, result.error) for result in results if not result.ok]
+    with suppress(TelegramBadRequest):
+        await status.edit_text(format_summary(len(results), failed, title))
+    return results
+
+
+@router.message(Command("broadcasts"))
+async def list_broadcasts(message: Message, state: FSMContext, repo: Repository):
+    await state.clear()
+
+    rows = await repo.get_recent_broadcasts()
+    if not rows:
+        await message.answer("Розсилок ще не було")
+        return
+
+    lines = []
+    btns = {}
+    for broadcast, delivered in rows:
+        title = plain_text(BroadcastPayload.load(broadcast.payload).caption).split("\n")[0]
+        lines.append(
+            f"#{broadcast.id} {broadcast.created:%d.%m %H:%M} — "
+            f"{html.escape(title[:40])} ({delivered} кан.)"
+        )
+        btns[f"✏️ #{broadcast.id}"] = f"bc_edit_{broadcast.id}"
+        btns[f"🗑 #{broadcast.id}"] = f"bc_delete_{broadcast.id}"
+
+    await message.answer("\n".join(lines), reply_markup=get_callback_btns(btns=btns))
+
+
+@router.callback_query(F.data.startswith("bc_edit_"))
+async def edit_broadcast(callback: CallbackQuery, state: FSMContext, repo: Repository):
+    broadcast_id = int(callback.data.split("_")[-1])
+    broadcast = await repo.get_broadcast(broadcast_id)
+
+    if not broadcast:
+        await callback.answer("Розсилку не знайдено")
+        return
+
+    await callback.answer()
+    await callback.message.answer(BroadcastPayload.load(broadcast.payload).caption or "—")
+    await callback.message.answer(f"Введіть новий підпис для розсилки #{broadcast_id} 👇")
+    await state.update_data(broadcast_id=broadcast_id)
+    await state.set_state(BroadcastEditState.caption)
+
+
+@router.message(BroadcastEditState.caption)
+async def edit_broadcast_caption(
+    message: Message, state: FSMContext, repo: Repository, bot: Bot
+):
+    broadcast_id = await state.get_value("broadcast_id")
+    broadcast = await repo.get_broadcast(broadcast_id)
+    if not broadcast:
+        await state.clear()
+        await message.answer("Розсилку не знайдено")
+        return
+
+    payload = BroadcastPayload.load(broadcast.payload)
+    try:
+        edited = compile_payload(list(payload.photos), message.html_text)
+    except PayloadError as e:
+        await message.answer(f"Підпис не підходить: {e}")
+        return
+    if edited.texts:
+        await message.answer("Підпис при редагуванні має вміщатися в 1024 символи")
+        return
+
+    await state.clear()
+    deliveries = await repo.get_deliveries(broadcast_id)
+    first_ids = {delivery.channel_id: json.loads(delivery.message_ids)[0] for delivery in deliveries}
+    # Далі лише дані в пам'яті: завершуємо транзакцію, щоб не тримати з'єднання весь прохід
+    await repo.commit()
+
+    async def send(chat_id: int):
+        try:
+            return await bot.edit_message_caption(
+                chat_id=chat_id, message_id=first_ids[chat_id], caption=edited.caption
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message:
+                raise
+
+    await run_on_deliveries(message, list(first_ids), send, "Підписи змінено")
+
+    await repo.update_broadcast_payload(
+        broadcast_id, replace(payload, caption=edited.caption).dump()
+    )
+    await repo.commit()
+
+
+@router.callback_query(F.data.startswith("bc_delete_"))
+async def delete_broadcast(callback: CallbackQuery):
+    broadcast_id = int(callback.data.split("_")[-1])
+    btns = {
+        "Так, видалити": f"bc_confirm_delete_{broadcast_id}",
+        "Скасувати": "bc_cancel",
+    }
+    await callback.answer()
+    await callback.message.answer(
+        f"Видалити розсилку #{broadcast_id} з усіх каналів?",
+        reply_markup=get_callback_btns(btns=btns),
+    )
+
+
+@router.callback_query(F.data == "bc_cancel")
+async def cancel_broadcast_action(callback: CallbackQuery):
+    await callback.answer()
+    await callback.message.delete()
+
+
+@router.callback_query(F.data.startswith("bc_confirm_delete_"))
+async def confirm_delete_broadcast(callback: CallbackQuery, repo: Repository, bot: Bot):
+    broadcast_id = int(callback.data.split("_")[-1])
+    deliveries = await repo.get_deliveries(broadcast_id)
+
+    if not deliveries:
+        await callback.answer("Немає надісланих повідомлень")
+        return
+
+    await callback.answer()
+    await callback.message.delete()
+    message_ids = {
+        delivery.channel_id: json.loads(delivery.message_ids) for delivery in deliveries
+    }
+    # Далі лише дані в пам'яті: завершуємо транзакцію, щоб не тримати з'єднання весь прохід
+    await repo.commit()
+
+    async def send(chat_id: int):
+        return await bot.delete_messages(chat_id=chat_id, message_ids=message_ids[chat_id])
+
+    results = await run_on_deliveries(callback.message, list(message_ids), send, "Видалено")
+
+    await repo.remove_deliveries(
+        broadcast_id, [result.chat_id for result in results if result.ok]
+    )
+    await repo.commit()
+
+
+# ---------- BATCH ----------
+
+BATCH_LIMIT = 100
+
+
+class BatchState(StatesGroup):
+    albums = State()
+
+
+batch_collect_kb = get_callback_btns(
+    btns={"Готово": "batch_done", "Скасувати": "batch_cancel"}
+)
+batch_review_kb = get_callback_btns(
+    btns={"Надіслати все": "batch_send", "Скасувати": "batch_cancel"}
+)
+
+
+def batch_rate_kb():
+    def build():
+        btns = {
+            f"{rate.currency} - {rate.rate}": f"batch_rate_{rate.id}"
+            for rate in rate_cache.all()
+        }
+        btns["Скасувати"] = "batch_cancel"
+        return get_callback_btns(btns=btns, sizes=(1,))
+
+    return markup_cache.get_or_build("batch_rate", rate_cache.version, build)
+
+
+def batch_review(
+    drafts: list[Draft], errors: dict[int, str], unconverted: dict[int, list[str]]
+) -> str:
+    lines = [f"Пакет: {len(drafts)} постів\n"]
+    for number, draft in enumerate(drafts, start=1):
+        title = next((line for line in draft.lines if line.strip()), "")
+        if len(title) > 60:
+            title = title[:60] + "…"
+        line = f"{number}. 🖼{len(draft.media_group)} {html.escape(title)}"
+        if number - 1 in errors:
+            line += f"\n    ⚠️ {html.escape(errors[number - 1])}"
+        if number - 1 in unconverted:
+            amounts = ", ".join(unconverted[number - 1])
+            line += f"\n    ℹ️ Немає курсу, не перераховано: {html.escape(amounts)}"
+        lines.append(line)
+    if errors:
+        lines.append("\nПости з ⚠️ буде пропущено.")
+
+    text = "\n".join(lines)
+    # Огляд — одне повідомлення, тож обрізаємо під ліміт Telegram
+    return text if len(text) <= MESSAGE_LIMIT else text[: MESSAGE_LIMIT - 1] + "…"
+
+
+@router.message(Command("batch"))
+async def batch(message: Message, state: FSMContext):
+    await state.clear()
+    await state.set_state(BatchState.albums)
+    await message.answer(
+        "Надсилайте альбоми з підписами. Коли закінчите — натисніть «Готово» 👇",
+        reply_markup=batch_collect_kb,
+    )
+
+
+@router.message(BatchState.albums)
+async def batch_album(message: Message, state: FSMContext, album: list[Message]):
+    text = next((msg.caption for msg in album if msg.caption), None)
+    if not text:
+        await message.answer("Приймаються тільки картинки або альбоми з підписом.")
+        return
+
+    posts = await state.get_value("batch") or []
+    if len(posts) >= BATCH_LIMIT:
+        await message.answer(f"Пакет заповнено ({BATCH_LIMIT} постів).")
+        return
+
+    media_group = [msg.photo[-1].file_id for msg in album if msg.photo]
+    posts.append(
+        {"message_id": message.message_id, **Draft(media_group=media_group, text=text).dump()}
+    )
+    # Альбоми обробляються паралельно, тож порядок пакета — за message_id, а не за часом обробки
+    posts.sort(key=lambda post: post["message_id"])
+    await state.update_data(batch=posts)
+    await message.answer(
+        f"Додано до пакета: {len(posts)}", reply_markup=batch_collect_kb
+    )
+
+
+@router.callback_query(F.data == "batch_done")
+async def batch_done(callback: CallbackQuery, state: FSMContext):
+    posts = await state.get_value("batch")
+    if not posts:
+        await callback.answer("Пакет порожній", show_alert=True)
+        return
+    if not rate_cache.all():
+        await callback.answer("Валюти не знайдено")
+        return
+
+    await callback.answer()
+
+    # Усі суми з валютою, для якої є курс, — вибір курсу не потрібен
+    rates = rate_cache.currency_rates
+    if all(converter.tokenize(post["text"]).resolves(rates) for post in posts):
+        await review_batch(callback, state, posts, rates)
+        return
+
+    await callback.message.edit_text(
+        "Виберіть валюту для всього пакета 👇", reply_markup=batch_rate_kb()
+    )
+
+
+@router.callback_query(F.data.startswith("batch_rate_"))
+async def batch_rate(callback: CallbackQuery, state: FSMContext):
+    rate = rate_cache.get(int(callback.data.split("_")[-1]))
+    posts = await state.get_value("batch")
+
+    if not rate or not posts:
+        await callback.answer("Валюту не знайдено")
+        return
+
+    await review_batch(callback, state, posts, rate_cache.rates_with(rate))
+
+
+async def review_batch(
+    callback: CallbackQuery, state: FSMContext, posts: list[dict], rates: dict[str, float]
+):
+    drafts = [Draft.load(post) for post in posts]
+    # Усі підписи пакета — одним проходом конвертера; кожна сума — за курсом своєї валюти
+    texts = converter.convert_many([draft.text for draft in drafts], None, rates)
+    errors = {}
+    unconverted = {}
+    for index, (draft, text) in enumerate(zip(drafts, texts)):
+        unresolved = converter.tokenize(draft.text).unresolved(rates)
+        if unresolved:
+            unconverted[index] = unresolved
+        draft.set_text(text)
+        try:
+            compile_payload(draft.media_group, draft.html())
+        except PayloadError as e:
+            errors[index] = str(e)
+
+    await state.update_data(
+        batch=[{**post, **draft.dump()} for post, draft in zip(posts, drafts)]
+    )
+    await callback.message.edit_text(
+        batch_review(drafts, errors, unconverted), reply_markup=batch_review_kb
+    )
+
+
+@router.callback_query(F.data == "batch_send")
+async def batch_send(
+    callback: CallbackQuery, state: FSMContext, repo: Repository, outbox: OutboxWorker
+):
+    posts = await state.get_value("batch") or []
+    payloads = []
+    for post in posts:
+        draft = Draft.load(post)
+        if not draft.lines:
+            continue  # валюту ще не вибрано
+        with suppress(PayloadError):
+            payloads.append(compile_payload(draft.media_group, draft.html()))
+
+    if not payloads:
+        await callback.answer("Немає постів для надсилання", show_alert=True)
+        return
+
+    await callback.answer()
+
+    channel_ids = [channel.channel_id for channel in await repo.get_channels() or []]
+    key = f"{callback.message.chat.id}:{callback.message.message_id}"
+    last = None
+    # Рядки outbox створюються в порядку пакета, а воркер тримає FIFO на канал
+    for number, payload in enumerate(payloads, start=1):
+        broadcast = await repo.create_broadcast(
+            key=f"{key}:{number}",
+            payload=payload.dump(),
+            channel_ids=channel_ids,
+        )
+        if not broadcast:
+            # Весь пакет — одна транзакція: відкочуємо вже створені пости, стан пакета лишаємо
+            failed = repo.failed
+            await repo.rollback()
+            if failed:
+                await callback.message.answer(
+                    f"Не вдалося поставити в чергу пост {number} з {len(payloads)}, "
+                    "пакет не надіслано. Спробуйте ще раз"
+                )
+            return  # інакше пакет уже ставить у чергу паралельне натискання
+        last = broadcast
+
+    # Звіт по каналах — за останнім постом: FIFO гарантує, що він завершиться останнім
+    last.report_chat_id = callback.message.chat.id
+    last.report_message_id = callback.message.message_id
+    await repo.commit()
+    await state.clear()
+    await callback.message.edit_text(f"Пакет з {len(payloads)} постів поставлено в чергу")
+    outbox.wake()
+    await outbox.report(last.id)
+
+
+@router.callback_query(F.data == "batch_cancel")
+async def batch_cancel(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("Пакет скасовано")
+
+
 @router.message(StateFilter(None))
 async def convert(message: Message, state: FSMContext, album: list[Message]):
     if not (
@@ -237,116 +720,211 @@ async def convert(message: Message, state: FSMContext, album: list[Message]):
     for msg in album:
         if msg.photo:
             file_id = msg.photo[-1].file_id
-            media_group.append(InputMediaPhoto(media=file_id))
+            media_group.append(file_id)
 
-    await message.answer_media_group(media=media_group)
+    await message.answer_media_group(
+        media=[InputMediaPhoto(media=file_id) for file_id in media_group]
+    )
     await message.answer(text)
-    await state.update_data(media_group=media_group, text=text)
-    await select_currency(message, state)
+    draft = Draft(media_group=media_group, text=text)
+    await select_currency(message, state, draft)
 
 
-async def select_currency(message: Message, state: FSMContext):
-    btns = {}
+async def select_currency(message: Message, state: FSMContext, draft: Draft):
+    if not rate_cache.all():
+        await message.answer("Валюти не знайдено")
+        await state.clear()
+        return
 
-    rates = await rq.orm_get_rates()
+    template = converter.tokenize(draft.text or "")
+    rates = rate_cache.currency_rates
 
-    if rates:
-        for rate in rates:
-            btns[f"{rate.currency} - {rate.rate}"] = f"select_rate_{rate.id}"
-    else:
-        await message.answer("Валюти не знайдено")
-        await state.clear()
+    # Валюта кожної суми відома і має курс — одразу конвертуємо, без кроку вибору
+    if template.resolves(rates):
+        draft.set_text(template.render(None, converter.price_format, rates))
+        await save_draft(state, draft)
+        await message.answer(draft.html(), reply_markup=main_kb)
         return
 
-    await message.answer(
-        "Виберіть валюту 👇", reply_markup=get_callback_btns(btns=btns)
-    )
+    await save_draft(state, draft)
+    await message.answer("Виберіть валюту 👇", reply_markup=select_rate_kb(template))
 
 
 @router.callback_query(F.data.startswith("select_rate_"))
 async def select_rate(callback: CallbackQuery, state: FSMContext):
     rate_id = int(callback.data.split("_")[-1])
-    rate = await rq.orm_get_rate(rate_id)
-    text = await state.get_value("text")
-    updated_text = replace_prices_with_uah(text, rate.rate)
+    rate = rate_cache.get(rate_id)
+    draft = await load_draft(state)
 
-    await callback.message.edit_text(
-        updated_text, reply_markup=get_callback_btns(btns=main_btns)
-    )
-    await state.update_data(lines=updated_text.split("\n"))
+    if not rate or draft is None:
+        await callback.answer("Валюту не знайдено")
+        return
+
+    # Вибраний курс — лише для сум у його валюті; суми в інших валютах без курсу не чіпаємо
+    rates = rate_cache.rates_with(rate)
+    draft.set_text(replace_prices_with_uah(draft.text, None, rates))
+
+    # Спершу зберігаємо: якщо edit_text впаде (напр. 429), чернетка вже оновлена
+    await save_draft(state, draft)
+    unresolved = converter.tokenize(draft.text).unresolved(rates)
+    if unresolved:
+        await callback.answer(
+            f"Немає курсу, не перераховано: {', '.join(unresolved)}", show_alert=True
+        )
+    await callback.message.edit_text(draft.html(), reply_markup=main_kb)
 
 
 @router.callback_query(F.data == "send_to_groups")
-async def send_to_groups(callback: CallbackQuery, state: FSMContext, bot: Bot):
-    data = await state.get_data()
-    lines = data.get("lines", [])
-    media_group = data.get("media_group", [])
+async def send_to_groups(
+    callback: CallbackQuery, state: FSMContext, repo: Repository, outbox: OutboxWorker
+):
+    draft = await load_draft(state)
 
-    if not media_group:
+    if not draft or not draft.media_group:
         await callback.message.answer("Альбом не знайдено у стані.")
         return
 
-    channels = await rq.orm_get_channels()
-
-    for channel in channels:
-        if re.match(r"^[0-9-]+$", channel.channel_id):
-            try:
-                media_group_with_caption = [
-                    (
-                        InputMediaPhoto(media=item.media, caption="\n".join(lines))
-                        if idx == 0
-                        else item
-                    )
-                    for idx, item in enumerate(media_group)
-                ]
-                await bot.send_media_group(
-                    chat_id=int(channel.channel_id), media=media_group_with_caption
-                )
-            except Exception as e:
-                await callback.message.answer(
-                    f"Помилка надсилання до каналу {channel.channel_id}"
-                )
-        else:
-            await callback.message.answer(f"Канал {channel.channel_id} не знайдено")
+    # Перевіряємо HTML і ліміти один раз тут, а не падаємо на кожному каналі
+    try:
+        payload = compile_payload(draft.media_group, draft.html())
+    except PayloadError as e:
+        await callback.answer(f"Пост не можна надіслати: {e}", show_alert=True)
+        return
+
+    await callback.answer()
+
+    channels = await repo.get_channels() or []
+    broadcast = await repo.create_broadcast(
+        key=f"{callback.message.chat.id}:{callback.message.message_id}",
+        payload=payload.dump(),
+        channel_ids=[channel.channel_id for channel in channels],
+        report_chat_id=callback.message.chat.id,
+        report_message_id=callback.message.message_id,
+    )
+
+    if not broadcast:
+        # Порожній результат без помилки — розсилку з цього повідомлення вже поставлено в чергу
+        failed = repo.failed
+        await repo.rollback()
+        if failed:
+            await callback.message.answer("Не вдалося поставити розсилку в чергу. Спробуйте ще раз")
+        return
 
-    await callback.message.edit_text("Повідомлення надіслані")
+    # Воркери читають outbox своїми сесіями, тому фіксуємо до wake()
+    await repo.commit()
     await state.clear()
+    await callback.message.edit_text("Розсилку поставлено в чергу")
+    outbox.wake()
+    await outbox.report(broadcast.id)
 
 
-@router.callback_query(F.data == "back")
-async def back(callback: CallbackQuery, state: FSMContext):
-    lines = await state.get_value("lines")
+# ---------- SCHEDULED POSTS ----------
+
+
+class ScheduleState(StatesGroup):
+    time = State()
+
+
+schedule_kb = get_callback_btns(btns={"Назад": "back"})
+
+
+@router.callback_query(F.data == "send_later")
+async def send_later(callback: CallbackQuery, state: FSMContext):
+    if not (draft := await draft_or_answer(callback, state)):
+        return
+
+    try:
+        compile_payload(draft.media_group, draft.html())
+    except PayloadError as e:
+        await callback.answer(f"Пост не можна надіслати: {e}", show_alert=True)
+        return
+
+    await callback.answer()
+    await state.set_state(ScheduleState.time)
     await callback.message.edit_text(
-        "\n".join(lines), reply_markup=get_callback_btns(btns=main_btns)
+        "Коли надіслати? Введіть час у форматі ГГ:ХХ, ДД.ММ ГГ:ХХ або ДД.ММ.РРРР ГГ:ХХ 👇",
+        reply_markup=schedule_kb,
     )
 
 
-@router.callback_query(F.data == "edit")
-async def edit(callback: CallbackQuery, state: FSMContext):
-    lines = await state.get_value("lines")
-    numbered_lines = [f"{i + 1}. {line}" for i, line in enumerate(lines)]
-    new_text = "\n".join(numbered_lines)
+@router.message(ScheduleState.time)
+async def schedule_time(
+    message: Message, state: FSMContext, repo: Repository, scheduler: Scheduler
+):
+    draft = await load_draft(state)
+    if draft is None:
+        await message.answer("Чернетку не знайдено")
+        await state.clear()
+        return
 
-    btns = {
-        "Добавити перехід на новий рядок": "add_line",
-        # "Видалити перехід на новий рядок": "remove_line",
-        "Виділити жирним": "add_bold",
-        "Назад": "back",
-    }
+    now = datetime.now(SCHEDULE_TZ)
+    run_at = parse_schedule_time(message.text or "", now)
+    if run_at is None:
+        await message.answer("Не вдалося розпізнати час. Приклад: 18:30 або 25.12 09:00 👇")
+        return
+    if run_at <= now:
+        await message.answer("Цей час уже минув, введіть інший 👇")
+        return
 
-    await state.update_data(lines=[f"{line}" for line in lines])
-    await callback.message.edit_text(
-        new_text, reply_markup=get_callback_btns(btns=btns, sizes=(1,))
+    try:
+        payload = compile_payload(draft.media_group, draft.html())
+    except PayloadError as e:
+        await message.answer(f"Пост не можна надіслати: {e}")
+        return
+
+    job = await repo.create_scheduled_job(
+        run_at=run_at.astimezone(timezone.utc).replace(tzinfo=None),
+        payload=payload.dump(),
+        report_chat_id=message.chat.id,
+    )
+    if not job:
+        await message.answer("Не вдалося запланувати розсилку")
+        return
+
+    await repo.commit()
+    await state.clear()
+    scheduler.add(job.id, job.run_at)
+    await message.answer(f"Розсилку заплановано на {run_at:%d.%m.%Y %H:%M}")
+
+
+async def draft_or_answer(callback: CallbackQuery, state: FSMContext) -> Optional[Draft]:
+    draft = await load_draft(state)
+    if draft is None:
+        await callback.answer("Чернетку не знайдено")
+    return draft
+
+
+DRAFT_CHANGED = "Чернетка змінилась, виберіть рядок ще раз"
+
+
+@router.callback_query(F.data == "back")
+async def back(callback: CallbackQuery, state: FSMContext):
+    if not (draft := await draft_or_answer(callback, state)):
+        return
+    # Повернення з вводу часу чи слів для жирного — знову головне меню чернетки
+    await state.set_state(None)
+    await callback.message.edit_text(draft.html(), reply_markup=main_kb)
+    # Кеш HTML рядків міг заповнитись під час рендеру
+    await save_draft(state, draft)
+
+
+@router.callback_query(F.data == "edit")
+async def edit(callback: CallbackQuery, state: FSMContext):
+    if not (draft := await draft_or_answer(callback, state)):
+        return
+    new_text = "\n".join(
+        f"{i + 1}. {draft.line_html(i)}" for i in range(len(draft.lines))
     )
+    await callback.message.edit_text(new_text, reply_markup=edit_kb)
 
 
 @router.callback_query(F.data == "add_line")
 async def add_line(callback: CallbackQuery, state: FSMContext):
-    lines = await state.get_value("lines")
-    numbered_lines = [f"{line}" for i, line in enumerate(lines)]
+    if not (draft := await draft_or_answer(callback, state)):
+        return
     btns = {}
 
-    for count, line in enumerate(numbered_lines):
+    for count, line in enumerate(draft.lines):
         btns[line] = f"line_{count+1}"
 
     btns["Назад"] = "back"
@@ -357,16 +935,20 @@ async def add_line(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("line_"))
-async def add_line(callback: CallbackQuery, state: FSMContext):
+async def insert_line(callback: CallbackQuery, state: FSMContext):
     line_number = int(callback.data.split("_")[1])
-    lines = await state.get_value("lines")
-    lines.insert(line_number, "")
-    new_text = "\n".join(lines)
+    if not (draft := await draft_or_answer(callback, state)):
+        return
+    # Кнопка line_N вставляє порожній рядок після рядка N
+    if not draft.has_line(line_number - 1):
+        await callback.answer(DRAFT_CHANGED)
+        with suppress(TelegramBadRequest):
+            await callback.message.edit_text(draft.html(), reply_markup=main_kb)
+        return
+    draft.insert_line(line_number)
 
-    await callback.message.edit_text(
-        new_text, reply_markup=get_callback_btns(btns=main_btns)
-    )
-    await state.update_data(lines=lines)
+    await save_draft(state, draft)
+    await callback.message.edit_text(draft.html(), reply_markup=main_kb)
 
 
 # @router.callback_query(F.data == "remove_line")
@@ -402,13 +984,14 @@ async def add_line(callback: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == "add_bold")
 async def add_bold(callback: CallbackQuery, state: FSMContext):
-    lines = await state.get_value("lines")
-    numbered_lines = [f"{line}" for i, line in enumerate(lines)]
+    if not (draft := await draft_or_answer(callback, state)):
+        return
     btns = {}
 
-    for count, line in enumerate(numbered_lines):
+    for count, line in enumerate(draft.lines):
         btns[line] = f"add_bold_{count}"
 
+    btns["Усі рядки"] = "add_bold_all"
     btns["Назад"] = "back"
 
     await callback.message.edit_text(
@@ -421,28 +1004,45 @@ class BoldState(StatesGroup):
 
 
 @router.callback_query(F.data.startswith("add_bold_"))
-async def add_bold(callback: CallbackQuery, state: FSMContext):
-    line_number = int(callback.data.split("_")[-1])
-    lines = await state.get_value("lines")
+async def select_bold_line(callback: CallbackQuery, state: FSMContext):
+    suffix = callback.data.split("_")[-1]
+    if not (draft := await draft_or_answer(callback, state)):
+        return
+    line_number = None if suffix == "all" else int(suffix)
+    if line_number is not None and not draft.has_line(line_number):
+        await callback.answer(DRAFT_CHANGED)
+        with suppress(TelegramBadRequest):
+            await callback.message.edit_text(draft.html(), reply_markup=main_kb)
+        return
+    draft.line_number = line_number
+    selected = (
+        draft.plain() if draft.line_number is None else draft.lines[draft.line_number]
+    )
 
-    await state.update_data(line_number=line_number)
+    await save_draft(state, draft)
     await callback.message.edit_text(
-        f"Введіть слова, які треба виділити жирним 👇\n\n<code>{lines[line_number]}</code>"
+        "Введіть слова, які треба виділити жирним (через кому) 👇"
+        f"\n\n<code>{html.escape(selected)}</code>"
     )
     await state.set_state(BoldState.words)
 
 
 @router.message(BoldState.words)
-async def add_bold(message: Message, state: FSMContext):
-    lines = await state.get_value("lines")
-    line_number = await state.get_value("line_number")
-    words = message.text
+async def save_bold_words(message: Message, state: FSMContext):
+    draft = await load_draft(state)
+    if draft is None:
+        await message.answer("Чернетку не знайдено")
+        await state.clear()
+        return
 
-    old_line = lines[line_number]
-    new_line = old_line.replace(words, f"<b>{words}</b>", 1)
-    lines[line_number] = new_line
+    if draft.line_number is not None and not draft.has_line(draft.line_number):
+        draft.line_number = None
+        await state.set_state(None)
+        await save_draft(state, draft)
+        await message.answer(DRAFT_CHANGED, reply_markup=main_kb)
+        return
 
-    new_text = "\n".join(lines)
+    draft.add_bold(split_words(message.text or ""), draft.line_number)
 
-    await message.answer(new_text, reply_markup=get_callback_btns(btns=main_btns))
-    await state.update_data(lines=lines)
+    await save_draft(state, draft)
+    await message.answer(draft.html(), reply_markup=main_kb)
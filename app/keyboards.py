@@ -1,6 +1,10 @@
+from typing import Any, Callable, Hashable, Optional, TypeVar
+
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+T = TypeVar("T")
+
 
 def get_callback_btns(*, btns: dict[str, str], sizes: tuple[int] = (2,)):
 
@@ -35,4 +39,36 @@ def get_inlineMix_btns(*, btns: dict[str, str], sizes: tuple[int] = (2,)):
         else:
             keyboard.add(InlineKeyboardButton(text=text, callback_data=value))
 
-    return keyboard.adjust(*sizes).as_markup()
\ No newline at end of file
+    return keyboard.adjust(*sizes).as_markup()
+
+
+class MarkupCache:
+    """Готові клавіатури за ключем; запис застаріває, коли змінюється версія даних."""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.entries: dict[Hashable, tuple[int, Any]] = {}
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        return None
+
+    def put(self, key: Hashable, version: int, value: T) -> T:
+        if key not in self.entries and len(self.entries) >= self.max_size:
+            self.entries.pop(next(iter(self.entries)))
+        self.entries[key] = (version, value)
+        return value
+
+    def get_or_build(self, key: Hashable, version: int, build: Callable[[], T]) -> T:
+        value = self.get(key, version)
+        if value is None:
+            value = self.put(key, version, build())
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+
+markup_cache = MarkupCache()
@@ -0,0 +1,96 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+LOG_ROTATE = os.getenv("LOG_ROTATE", "size")  # size | time
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 7))
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - [%(update_id)s] %(message)s"
+
+# ID апдейту, який зараз обробляється; ставить LogContextMiddleware
+update_id_var: ContextVar[Optional[int]] = ContextVar("update_id", default=None)
+
+
+class UpdateContextFilter(logging.Filter):
+    """Додає update_id до запису. Стоїть на QueueHandler, тобто виконується в потоці циклу подій."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        update_id = update_id_var.get()
+        record.update_id = update_id if update_id is not None else "-"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "update_id": getattr(record, "update_id", None),
+        }
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(QueueHandler):
+    """Як QueueHandler, але traceback лишається окремо в exc_text, а не зливається з message."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _file_handler() -> logging.Handler:
+    if LOG_ROTATE == "time":
+        return TimedRotatingFileHandler(
+            LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    return RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+
+
+def setup_logging() -> QueueListener:
+    """Цикл подій лише кладе записи в чергу; файл і консоль пише фоновий потік QueueListener."""
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [_file_handler(), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(UpdateContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # stop() дописує все, що лишилось у черзі
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,279 @@
+import inspect
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # 0 — endpoint вимкнено
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, _labels(self.labelnames, key), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ключ міток -> [лічильники по бакетах + +Inf, сума, кількість]
+        self.values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, key: tuple[str, ...], q: float) -> float:
+        """Верхня межа бакета, в який потрапляє q-квантиль (оцінка)."""
+        counts, _, total = self.values[key]
+        target = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for key, (counts, total_sum, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket", _labels(names, key + (le,)), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, key), total_sum
+            yield f"{self.name}_count", _labels(self.labelnames, key), count
+
+
+class Callback:
+    """Значення, яке читається з іншого об'єкта в момент збору (напр. лічильники AlbumStats)."""
+
+    def __init__(self, name: str, help: str, read: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        yield self.name, "", self.read()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, object] = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, read: Callable[[], float], kind: str = "gauge"):
+        return self._register(Callback(name, help, read, kind))
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[str]:
+        """Короткий людський звіт для /stats: кількість, середнє і p99 для гістограм."""
+        lines = []
+        for metric in self.metrics.values():
+            if isinstance(metric, Histogram):
+                for key, (_, total_sum, count) in sorted(metric.values.items()):
+                    labels = f"[{','.join(key)}]" if key else ""
+                    lines.append(
+                        f"{metric.name}{labels} n={count} "
+                        f"avg={total_sum / count * 1000:.1f}ms "
+                        f"p99≤{metric.quantile(key, 0.99) * 1000:.0f}ms"
+                    )
+            else:
+                for name, labels, value in metric.samples():
+                    if value:
+                        lines.append(f"{name}{labels} {value:g}")
+        return lines
+
+
+registry = Registry()
+
+UPDATE_SECONDS = registry.histogram(
+    "bot_update_seconds", "Update processing time by event type", ("event",)
+)
+HANDLER_SECONDS = registry.histogram(
+    "bot_handler_seconds", "Handler latency", ("handler",)
+)
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "Exceptions raised by handlers", ("handler",)
+)
+DB_SECONDS = registry.histogram(
+    "bot_db_seconds", "Repository method latency", ("method",)
+)
+API_SECONDS = registry.histogram(
+    "bot_api_seconds", "Bot API request latency", ("method",)
+)
+API_ERRORS = registry.counter(
+    "bot_api_errors_total", "Bot API errors", ("method", "error")
+)
+API_RETRY_AFTER = registry.counter(
+    "bot_api_retry_after_total", "Bot API 429 flood control responses", ("method",)
+)
+ALBUM_SECONDS = registry.histogram(
+    "bot_album_collect_seconds", "Time from first album part to handler", ()
+)
+BROADCAST_SECONDS = registry.histogram(
+    "bot_broadcast_seconds",
+    "Time from queueing a broadcast to its final report",
+    (),
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+OUTBOX_DELIVERIES = registry.counter(
+    "bot_outbox_deliveries_total", "Finished outbox rows by status", ("status",)
+)
+FSM_EVICTIONS = registry.counter(
+    "bot_fsm_evictions_total", "FSM records dropped by TTL sweep or memory cap", ("reason",)
+)
+
+
+def timed(histogram: Histogram, **labels):
+    """Декоратор корутини: час виконання в histogram з фіксованими мітками."""
+
+    def decorate(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def instrument(histogram: Histogram = DB_SECONDS, label: str = "method"):
+    """Декоратор класу: обгортає всі публічні async-методи в timed()."""
+
+    def decorate(cls):
+        for name, value in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.iscoroutinefunction(value):
+                continue
+            setattr(cls, name, timed(histogram, **{label: name})(value))
+        return cls
+
+    return decorate
+
+
+class MetricsSession(AiohttpSession):
+    """aiohttp-сесія aiogram, що міряє кожен виклик Bot API."""
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, timeout=timeout)
+        except TelegramRetryAfter:
+            API_RETRY_AFTER.inc(method=name)
+            raise
+        except TelegramAPIError as e:
+            API_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=name)
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(
+        body=registry.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def start_metrics_server(
+    host: str = METRICS_HOST, port: int = METRICS_PORT
+) -> Optional[web.AppRunner]:
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info("Metrics endpoint listening on %s:%s/metrics", host, port)
+    return runner
@@ -1,12 +1,23 @@
-from typing import Any, Awaitable, Callable, Dict
+from typing import Any, Awaitable, Callable, Dict, Optional
 
 import asyncio
+import logging
+import time
+from collections import Counter, deque
+from contextlib import suppress
+from dataclasses import dataclass, field
 from aiogram import BaseMiddleware
 
 from typing import Callable, Any, Awaitable, Union
-from aiogram.types import TelegramObject, Message
+from aiogram.types import TelegramObject, Message, Update
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from app.database import Repository
+from app.logs import update_id_var
+from app.metrics import ALBUM_SECONDS, HANDLER_ERRORS, HANDLER_SECONDS, UPDATE_SECONDS
+
+logger = logging.getLogger(__name__)
+
 
 class DataBaseSession(BaseMiddleware):
     def __init__(self, session_pool: async_sessionmaker):
@@ -19,15 +30,235 @@ class DataBaseSession(BaseMiddleware):
         data: Dict[str, Any],
     ) -> Any:
         async with self.session_pool() as session:
+            repo = Repository(session)
             data["session"] = session
+            data["repo"] = repo
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await repo.rollback()
+                raise
+            await repo.commit()
+            return result
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Outer middleware на dp.update: всі записи логу під час обробки мають update_id."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = update_id_var.set(getattr(event, "update_id", None))
+        try:
             return await handler(event, data)
+        finally:
+            update_id_var.reset(token)
 
 
-class AlbumMiddleware(BaseMiddleware):
-    album_data: dict = {}
+class ConcurrencyLimit(BaseMiddleware):
+    """Обмежує кількість апдейтів, що обробляються одночасно (webhook)."""
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self.semaphore:
+            return await handler(event, data)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """На dp.update — час апдейту за типом події; на спостерігачі роутера — час хендлера."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update):
+            with UPDATE_SECONDS.time(event=event.event_type):
+                return await handler(event, data)
+
+        handler_object = data.get("handler")
+        # Мітка — ім'я функції-хендлера, тож імена хендлерів у роутері мають бути унікальні
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+        try:
+            with HANDLER_SECONDS.time(handler=name):
+                return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+
 
-    def __init__(self, latency: Union[int, float] = 0.01):
+@dataclass
+class AlbumStats:
+    albums: int = 0
+    parts: int = 0
+    late_parts: int = 0
+    evicted: int = 0
+    expired: int = 0
+    sizes: Counter = field(default_factory=Counter)
+    latencies: deque = field(default_factory=lambda: deque(maxlen=1000))
+
+    def record(self, size: int, latency: float):
+        self.albums += 1
+        self.parts += size
+        self.sizes[size] += 1
+        self.latencies.append(latency)
+
+    def snapshot(self) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            "albums": self.albums,
+            "parts": self.parts,
+            "late_parts": self.late_parts,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "sizes": dict(sorted(self.sizes.items())),
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
+@dataclass
+class _Album:
+    messages: list[Message]
+    started: float
+    arrived: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class AlbumCollector:
+    """Збирає частини media group: таймер тиші скидається з кожною новою частиною."""
+
+    def __init__(
+        self,
+        latency: float = 0.3,
+        max_size: int = 10,
+        max_wait: float = 3.0,
+        max_groups: int = 1000,
+    ):
         self.latency = latency
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.max_groups = max_groups
+        self.groups: dict[tuple[int, str], _Album] = {}
+        # Групи, які вже віддані хендлеру: пізні частини відкидаємо, а не стартуємо новий альбом
+        self.flushed: dict[tuple[int, str], float] = {}
+        self.stats = AlbumStats()
+
+    def _evict(self, now: float):
+        for key, expires in list(self.flushed.items()):
+            if expires > now and len(self.flushed) <= self.max_groups:
+                break
+            del self.flushed[key]
+
+        while len(self.groups) >= self.max_groups:
+            key = next(iter(self.groups))
+            self.groups.pop(key).arrived.set()
+            self.stats.evicted += 1
+
+    def sweep(self):
+        """Фонове прибирання: прострочені позначки flushed і групи, яких ніхто вже не чекає."""
+        now = time.monotonic()
+        for key, expires in list(self.flushed.items()):
+            if expires <= now:
+                del self.flushed[key]
+                self.stats.expired += 1
+
+        # collect() сам прибирає групу не пізніше max_wait; довше — лише якщо його скасували
+        for key, album in list(self.groups.items()):
+            if now - album.started > self.max_wait * 2:
+                self.groups.pop(key).arrived.set()
+                self.stats.expired += 1
+
+    async def collect(self, message: Message) -> Optional[list[Message]]:
+        key = (message.chat.id, message.media_group_id)
+        now = time.monotonic()
+
+        album = self.groups.get(key)
+        if album is not None:
+            album.messages.append(message)
+            album.arrived.set()
+            return None
+
+        if key in self.flushed:
+            self.stats.late_parts += 1
+            return None
+
+        self._evict(now)
+        album = self.groups[key] = _Album(messages=[message], started=now)
+
+        try:
+            while len(album.messages) < self.max_size:
+                remaining = album.started + self.max_wait - time.monotonic()
+                if remaining <= 0 or self.groups.get(key) is not album:
+                    break
+
+                album.arrived.clear()
+                try:
+                    await asyncio.wait_for(
+                        album.arrived.wait(), timeout=min(self.latency, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            if self.groups.get(key) is album:
+                del self.groups[key]
+            self.flushed[key] = time.monotonic() + self.max_wait
+
+        latency = time.monotonic() - album.started
+        self.stats.record(len(album.messages), latency)
+        ALBUM_SECONDS.observe(latency)
+        if self.stats.albums % 100 == 0:
+            logger.info("Album collector stats: %s", self.stats.snapshot())
+        return sorted(album.messages, key=lambda msg: msg.message_id)
+
+
+class AlbumMiddleware(BaseMiddleware):
+    def __init__(
+        self,
+        latency: Union[int, float] = 0.3,
+        max_size: int = 10,
+        sweep_interval: float = 60,
+    ):
+        self.collector = AlbumCollector(latency=latency, max_size=max_size)
+        self.sweep_interval = sweep_interval
+        self.sweep_task: Optional[asyncio.Task] = None
+
+    @property
+    def stats(self) -> AlbumStats:
+        return self.collector.stats
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.collector.sweep()
+
+    async def start(self):
+        if self.sweep_task is None:
+            self.sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self.sweep_task is not None:
+            self.sweep_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.sweep_task
+            self.sweep_task = None
 
     async def __call__(
         self,
@@ -40,18 +271,11 @@ class AlbumMiddleware(BaseMiddleware):
         if not message.media_group_id:
             if message.photo:
                 data["album"] = [message]
-            await handler(message, data)
+            return await handler(message, data)
+
+        album = await self.collector.collect(message)
+        if album is None:
             return
-        try:
-            self.album_data[message.media_group_id].append(message)
-        except KeyError:
-            self.album_data[message.media_group_id] = [message]
-            await asyncio.sleep(self.latency)
-
-            data["_is_last"] = True
-            data["album"] = self.album_data[message.media_group_id]
-            await handler(message, data)
-
-        if message.media_group_id and data.get("_is_last"):
-            del self.album_data[message.media_group_id]
-            del data["_is_last"]
+
+        data["album"] = album
+        return await handler(album[0], data)
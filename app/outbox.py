@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import suppress
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from dotenv import load_dotenv
+
+from app.database import Outbox, unit_of_work, utcnow, writer
+from app.broadcast import Broadcaster, format_summary
+from app.metrics import BROADCAST_SECONDS, OUTBOX_DELIVERIES
+from app.payload import BroadcastPayload
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+WORKERS = int(os.getenv("OUTBOX_WORKERS", 10))
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 5))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 2))
+BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 300))
+
+
+class OutboxWorker:
+    """Пул воркерів, що розсилає рядки таблиці outbox з повторами та backoff.
+
+    Доставка at-least-once: див. Repository.reset_outbox.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = WORKERS,
+        poll_interval: float = POLL_INTERVAL,
+        broadcaster: Broadcaster = None,
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.broadcaster = broadcaster or Broadcaster(max_retries=0)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=workers)
+        self.tasks: list[asyncio.Task] = []
+        self.payloads: dict[int, BroadcastPayload] = {}
+        self.progress: dict[int, float] = {}
+        self.started: dict[int, float] = {}
+        # broadcast_id -> [завершено, всього]; рахується в пам'яті, а не перечитується з outbox
+        self.counts: dict[int, list[int]] = {}
+        self.targets: dict[int, Optional[tuple[int, int]]] = {}
+        self._wake = asyncio.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    async def start(self):
+        # Рядки, що надсилались під час падіння/рестарту, повертаємо в чергу
+        await writer.submit(lambda repo: repo.reset_outbox())
+        self.tasks.append(asyncio.create_task(self._feed()))
+        for _ in range(self.workers):
+            self.tasks.append(asyncio.create_task(self._work()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+        await writer.submit(lambda repo: repo.reset_outbox())
+
+    async def _sleep(self):
+        timeout = self.poll_interval
+        async with unit_of_work() as repo:
+            due = await repo.next_outbox_due()
+        if due:
+            timeout = min(timeout, max((due - utcnow()).total_seconds(), 0.05))
+
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+        self._wake.clear()
+
+    async def _feed(self):
+        while True:
+            try:
+                rows = await writer.submit(lambda repo: repo.claim_outbox(limit=self.workers))
+                for row in rows:
+                    await self.queue.put(row)
+                if not rows:
+                    await self._sleep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox feed failed")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _work(self):
+        while True:
+            row = await self.queue.get()
+            try:
+                await self._process(row)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox delivery %s failed", row.id)
+            finally:
+                self.queue.task_done()
+
+    async def _payload(self, broadcast_id: int) -> BroadcastPayload:
+        # Пост зібраний один раз при постановці в чергу; тут лише розбираємо JSON
+        payload = self.payloads.get(broadcast_id)
+        if payload is None:
+            async with unit_of_work() as repo:
+                broadcast = await repo.get_broadcast(broadcast_id)
+            payload = BroadcastPayload.load(broadcast.payload)
+            if len(self.payloads) >= 100:
+                self.payloads.pop(next(iter(self.payloads)))
+            self.payloads[broadcast_id] = payload
+        return payload
+
+    async def _process(self, row: Outbox):
+        payload = await self._payload(row.broadcast_id)
+        # Уже надіслані кроки (альбом, тексти) — з журналу доставки: повтор після 429
+        # чи рестарту продовжує з кроку, що впав, а не шле альбом удруге
+        async with unit_of_work() as repo:
+            delivery = await repo.get_delivery(row.broadcast_id, row.channel_id)
+        sent: list[int] = json.loads(delivery.message_ids) if delivery else []
+        album_size = len(payload.media)
+
+        async def record(chat_id: int, message_ids: list[int]):
+            sent.extend(message_ids)
+            ids = list(sent)
+            await writer.submit(lambda repo: repo.record_delivery(row.broadcast_id, row.channel_id, ids))
+
+        async def send(chat_id: int):
+            if len(sent) < album_size:
+                album = await self.bot.send_media_group(chat_id=chat_id, media=list(payload.media))
+                await record(chat_id, [message.message_id for message in album])
+            while len(sent) < album_size + len(payload.texts):
+                text = payload.texts[len(sent) - album_size]
+                message = await self.bot.send_message(chat_id=chat_id, text=text)
+                await record(chat_id, [message.message_id])
+            return list(sent)
+
+        result = await self.broadcaster.deliver(
+            int(row.channel_id), send, cost=1 + len(payload.texts)
+        )
+
+        if result.ok:
+
+            await writer.submit(lambda repo: repo.finish_outbox(row.id, "sent"))
+            OUTBOX_DELIVERIES.inc(status="sent")
+        elif result.retryable and row.attempts < MAX_ATTEMPTS:
+            delay = result.retry_after or min(BACKOFF_BASE ** row.attempts, BACKOFF_MAX)
+            await writer.submit(lambda repo: repo.retry_outbox(row.id, delay, result.error))
+            OUTBOX_DELIVERIES.inc(status="retry")
+            self.wake()
+            return
+        else:
+            await writer.submit(lambda repo: repo.finish_outbox(row.id, "failed", result.error))
+            OUTBOX_DELIVERIES.inc(status="failed")
+
+        # Наступний пост цього каналу вже можна брати (FIFO на канал)
+        self.wake()
+        await self.report(row.broadcast_id, finished=1)
+
+    async def _load_counts(self, broadcast_id: int) -> list[int]:
+        async with unit_of_work() as repo:
+            by_status = await repo.count_outbox(broadcast_id)
+        done = by_status.get("sent", 0) + by_status.get("failed", 0)
+        counts = self.counts[broadcast_id] = [done, sum(by_status.values())]
+        return counts
+
+    async def _target(self, broadcast_id: int) -> Optional[tuple[int, int]]:
+        # Куди звітувати (chat_id, message_id); None — розсилка без повідомлення-звіту
+        if broadcast_id not in self.targets:
+            async with unit_of_work() as repo:
+                broadcast = await repo.get_broadcast(broadcast_id)
+            self.targets[broadcast_id] = (
+                (broadcast.report_chat_id, broadcast.report_message_id)
+                if broadcast and broadcast.report_chat_id
+                else None
+            )
+        return self.targets[broadcast_id]
+
+    async def report(self, broadcast_id: int, finished: int = 0):
+        counts = self.counts.get(broadcast_id)
+        if counts is None:
+            # Перший report() (після постановки в чергу чи рестарту): один агрегатний запит
+            counts = await self._load_counts(broadcast_id)
+        else:
+            counts[0] += finished
+
+        # Лічильник міг розійтися з БД (напр. після рестарту), тож кінець перевіряємо запитом
+        if counts[0] >= counts[1]:
+            counts = await self._load_counts(broadcast_id)
+        done, total = counts
+        is_finished = done >= total
+
+        now = time.monotonic()
+        started = self.started.setdefault(broadcast_id, now)
+        if not is_finished and now - self.progress.get(broadcast_id, 0) < 1:
+            return
+        self.progress[broadcast_id] = now
+
+        target = await self._target(broadcast_id)
+        if is_finished:
+            self.progress.pop(broadcast_id, None)
+            self.payloads.pop(broadcast_id, None)
+            self.started.pop(broadcast_id, None)
+            self.counts.pop(broadcast_id, None)
+            self.targets.pop(broadcast_id, None)
+            BROADCAST_SECONDS.observe(now - started)
+            if target is None:
+                return
+            if not await writer.submit(lambda repo: repo.mark_broadcast_reported(broadcast_id)):
+                return
+            async with unit_of_work() as repo:
+                failed = await repo.get_outbox(broadcast_id, status="failed")
+            text = format_summary(total, [(row.channel_id, row.error) for row in failed])
+        elif target is None:
+            return
+        else:
+            text = f"Надсилання... {done}/{total}"
+
+        chat_id, message_id = target
+        with suppress(TelegramBadRequest):
+            await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
@@ -0,0 +1,160 @@
+import html
+import json
+import re
+from dataclasses import dataclass
+from functools import cached_property
+from html.parser import HTMLParser
+
+from aiogram.types import InputMediaPhoto
+
+
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+# Теги, які підтримує Telegram у parse_mode=HTML
+ALLOWED_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "span", "tg-spoiler", "a", "code", "pre", "blockquote", "tg-emoji",
+}
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def telegram_length(text: str) -> int:
+    # Telegram рахує ліміти в UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+
+class _HTMLChecker(HTMLParser):
+    """Перевіряє теги та екранує «голі» &, <, > у тексті. Рахує видиму довжину."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.out: list[str] = []
+        self.stack: list[str] = []
+        self.visible = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ALLOWED_TAGS:
+            raise PayloadError(f"Непідтримуваний тег <{tag}>")
+        self.stack.append(tag)
+        self.out.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            raise PayloadError(f"Незакритий або зайвий тег </{tag}>")
+        self.stack.pop()
+        self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        self.visible += telegram_length(data)
+        self.out.append(html.escape(data, quote=False))
+
+    def handle_entityref(self, name):
+        self.visible += 1
+        self.out.append(f"&{name};")
+
+    def handle_charref(self, name):
+        self.visible += 1
+        self.out.append(f"&#{name};")
+
+    def result(self) -> str:
+        self.close()
+        # HTMLParser залишає в rawdata неповний «тег», напр. "a < b"
+        if self.rawdata:
+            self.handle_data(self.rawdata)
+            self.rawdata = ""
+        return "".join(self.out)
+
+
+def normalize_html(text: str) -> tuple[str, int, list[str]]:
+    """-> (безпечний HTML, видима довжина, відкриті теги в кінці)."""
+    checker = _HTMLChecker()
+    checker.feed(text)
+    return checker.result(), checker.visible, checker.stack
+
+
+def plain_text(text: str) -> str:
+    return html.unescape(re.sub(r"<[^>]*>", "", text or ""))
+
+
+def _blocks(text: str) -> list[tuple[str, int]]:
+    # Блок — рядки, між якими тег не перетинає межу; різати можна лише між блоками
+    blocks = []
+    pending = []
+    for line in text.split("\n"):
+        pending.append(line)
+        html_text, visible, open_tags = normalize_html("\n".join(pending))
+        if not open_tags:
+            blocks.append((html_text, visible))
+            pending = []
+    if pending:
+        _, _, open_tags = normalize_html("\n".join(pending))
+        raise PayloadError(f"Незакритий тег <{open_tags[-1]}>")
+    return blocks
+
+
+def _pack(blocks: list[tuple[str, int]], limit: int) -> tuple[list[str], list[tuple[str, int]]]:
+    chunk = []
+    size = 0
+    for index, (text, visible) in enumerate(blocks):
+        added = visible + (1 if chunk else 0)
+        if size + added > limit:
+            return chunk, blocks[index:]
+        chunk.append(text)
+        size += added
+    return chunk, []
+
+
+@dataclass(frozen=True)
+class BroadcastPayload:
+    photos: tuple[str, ...]
+    caption: str
+    texts: tuple[str, ...] = ()
+
+    @cached_property
+    def media(self) -> tuple[InputMediaPhoto, ...]:
+        return tuple(
+            InputMediaPhoto(media=file_id, caption=self.caption if idx == 0 else None)
+            for idx, file_id in enumerate(self.photos)
+        )
+
+    def dump(self) -> str:
+        return json.dumps(
+            {"photos": self.photos, "caption": self.caption, "texts": self.texts},
+            ensure_ascii=False,
+        )
+
+    @classmethod
+    def load(cls, raw: str) -> "BroadcastPayload":
+        data = json.loads(raw)
+        return cls(
+            photos=tuple(data["photos"]),
+            caption=data["caption"],
+            texts=tuple(data.get("texts", ())),
+        )
+
+
+def compile_payload(photos: list[str], caption: str) -> BroadcastPayload:
+    """Збирає пост один раз на розсилку: перевіряє HTML і виносить хвіст підпису понад 1024 у текст."""
+    if not photos:
+        raise PayloadError("Альбом не містить фото")
+    if len(photos) > 10:
+        raise PayloadError("Альбом може містити не більше 10 фото")
+
+    blocks = _blocks(caption or "")
+    caption_blocks, rest = _pack(blocks, CAPTION_LIMIT)
+
+    texts = []
+    while rest:
+        chunk, tail = _pack(rest, MESSAGE_LIMIT)
+        if not chunk:
+            raise PayloadError(f"Рядок довший за {MESSAGE_LIMIT} символів")
+        texts.append("\n".join(chunk))
+        rest = tail
+
+    return BroadcastPayload(
+        photos=tuple(photos), caption="\n".join(caption_blocks), texts=tuple(texts)
+    )
@@ -0,0 +1,143 @@
+import asyncio
+import heapq
+import logging
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from app.database import unit_of_work, utcnow, writer
+from app.outbox import OutboxWorker
+
+logger = logging.getLogger(__name__)
+
+# Завдання, яке не вдалося поставити в чергу, повторюється з подвоєнням паузи;
+# після MAX_ATTEMPTS спроб позначається failed
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 3600
+MAX_ATTEMPTS = 5
+
+
+class Scheduler:
+    """Відкладені пости: купа (run_at, job_id) у пам'яті, сон до найближчого завдання.
+
+    Джерело істини — таблиця scheduled_jobs; купа лише відтворюється з неї на старті.
+    """
+
+    def __init__(self, bot: Bot, outbox: OutboxWorker):
+        self.bot = bot
+        self.outbox = outbox
+        self.heap: list[tuple[datetime, int]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.attempts: dict[int, int] = {}
+        # job_id -> (chat_id, message_id) повідомлення-звіту: між спробами редагуємо те саме
+        self.statuses: dict[int, tuple[int, int]] = {}
+        self._wake = asyncio.Event()
+
+    def add(self, job_id: int, run_at: datetime):
+        heapq.heappush(self.heap, (run_at, job_id))
+        # Будимо, лише якщо нове завдання раніше за те, на яке вже чекаємо
+        if self.heap[0][1] == job_id:
+            self._wake.set()
+
+    async def start(self):
+        async with unit_of_work() as repo:
+            jobs = await repo.get_pending_jobs()
+        # Прострочені за час простою виконуються одразу після старту
+        self.heap = [(job.run_at, job.id) for job in jobs]
+        heapq.heapify(self.heap)
+        if jobs:
+            logger.info("Scheduler: %s pending jobs", len(jobs))
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+    async def _run(self):
+        while True:
+            timeout = None
+            if self.heap:
+                timeout = (self.heap[0][0] - utcnow()).total_seconds()
+
+            if timeout is None or timeout > 0:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+                self._wake.clear()
+                continue
+
+            _, job_id = heapq.heappop(self.heap)
+            try:
+                done = await self._fire(job_id)
+            except Exception:
+                logger.exception("Scheduled job %s failed", job_id)
+                done = False
+
+            if done:
+                self.attempts.pop(job_id, None)
+                self.statuses.pop(job_id, None)
+                continue
+
+            attempt = self.attempts[job_id] = self.attempts.get(job_id, 0) + 1
+            if attempt >= MAX_ATTEMPTS:
+                await self._give_up(job_id)
+                continue
+            # У БД завдання лишилось pending: повертаємо в купу, а не чекаємо рестарту
+            delay = min(RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+            logger.warning("Scheduled job %s: retry %s in %ss", job_id, attempt, delay)
+            heapq.heappush(self.heap, (utcnow() + timedelta(seconds=delay), job_id))
+            await self._status(
+                job_id,
+                f"Запланована розсилка: не вдалося поставити в чергу (спроба {attempt} з "
+                f"{MAX_ATTEMPTS}), повтор через {delay} с",
+            )
+
+    async def _give_up(self, job_id: int):
+        self.attempts.pop(job_id, None)
+        logger.error("Scheduled job %s failed after %s attempts", job_id, MAX_ATTEMPTS)
+        try:
+            await writer.submit(lambda repo: repo.fail_scheduled_job(job_id))
+        except Exception:
+            logger.exception("Scheduled job %s: marking failed", job_id)
+        await self._status(job_id, f"Запланована розсилка не вдалася після {MAX_ATTEMPTS} спроб")
+        self.statuses.pop(job_id, None)
+
+    async def _status(self, job_id: int, text: str):
+        target = self.statuses.get(job_id)
+        if target is None:
+            return
+        chat_id, message_id = target
+        with suppress(TelegramAPIError):
+            await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+
+    async def _fire(self, job_id: int) -> bool:
+        """Ставить завдання в outbox; False — завдання лишилось pending і його треба повторити."""
+        async with unit_of_work() as repo:
+            job = await repo.get_scheduled_job(job_id)
+        if job is None or job.status != "pending":
+            return True  # вже виконане (дубль у купі)
+
+        # Повідомлення-звіт створюємо заздалегідь (один раз на всі спроби): outbox редагує його
+        if job.report_chat_id and job_id not in self.statuses:
+            with suppress(TelegramAPIError):
+                status = await self.bot.send_message(
+                    job.report_chat_id, "Запланована розсилка: ставлю в чергу..."
+                )
+                self.statuses[job_id] = (job.report_chat_id, status.message_id)
+        report_message_id = self.statuses[job_id][1] if job_id in self.statuses else None
+
+        broadcast_id = await writer.submit(
+            lambda repo: repo.start_scheduled_job(job_id, report_message_id)
+        )
+        if not broadcast_id:
+            return False
+
+        logger.info("Scheduled job %s -> broadcast %s", job_id, broadcast_id)
+        self.outbox.wake()
+        await self.outbox.report(broadcast_id)
+        return True
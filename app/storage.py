@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from copy import deepcopy
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from dotenv import load_dotenv
+
+from app.database import unit_of_work, utcnow, writer
+from app.metrics import FSM_EVICTIONS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 2))
+# Чернетки без активності довше DRAFT_TTL секунд видаляються (з пам'яті і з БД)
+DRAFT_TTL = float(os.getenv("DRAFT_TTL", 6 * 3600))
+DRAFT_SWEEP_INTERVAL = float(os.getenv("DRAFT_SWEEP_INTERVAL", 60))
+# Верхня межа даних FSM у пам'яті (байти JSON); понад неї — LRU-витіснення збережених записів
+FSM_MEMORY_LIMIT = int(os.getenv("FSM_MEMORY_LIMIT", 16 * 1024 * 1024))
+
+ExpireCallback = Callable[[StorageKey, Dict[str, Any]], Awaitable[Any]]
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """FSM у таблиці fsm: читання/запис у пам'яті, зміни скидаються в БД пачками.
+
+    Записи в пам'яті впорядковані за останнім доступом: з початку беруться і прострочені
+    (TTL), і кандидати на витіснення, коли перевищено memory_limit.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = FLUSH_INTERVAL,
+        key_builder: Optional[KeyBuilder] = None,
+        ttl: float = DRAFT_TTL,
+        sweep_interval: float = DRAFT_SWEEP_INTERVAL,
+        memory_limit: int = FSM_MEMORY_LIMIT,
+        on_expire: Optional[ExpireCallback] = None,
+    ):
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.memory_limit = memory_limit
+        self.on_expire = on_expire
+        self.states: dict[str, Optional[str]] = {}
+        self.data: dict[str, dict[str, Any]] = {}
+        self.keys: dict[str, StorageKey] = {}
+        self.touched: OrderedDict[str, float] = OrderedDict()
+        self.sizes: dict[str, int] = {}
+        self.memory = 0
+        self.dirty: set[str] = set()
+        # Записи, що саме пишуться в БД: їх не можна витісняти, бо в БД ще стара версія
+        self.flushing: set[str] = set()
+        self.lock = asyncio.Lock()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.sweep_task: Optional[asyncio.Task] = None
+
+    async def _load(self, key: StorageKey) -> str:
+        record_key = self.key_builder.build(key)
+        if record_key not in self.data:
+            async with self.lock:
+                if record_key not in self.data:
+                    async with unit_of_work() as repo:
+                        record = await repo.get_fsm(record_key)
+                    self.states[record_key] = record.state if record else None
+                    self.data[record_key] = json.loads(record.data) if record and record.data else {}
+                    self._resize(record_key, len(record.data) if record and record.data else 0)
+
+        self.keys[record_key] = key
+        self.touched[record_key] = time.monotonic()
+        self.touched.move_to_end(record_key)
+        return record_key
+
+    # ---------- MEMORY ----------
+
+    def _resize(self, record_key: str, size: int):
+        self.memory += size - self.sizes.get(record_key, 0)
+        self.sizes[record_key] = size
+
+    def _drop(self, record_key: str):
+        self.memory -= self.sizes.pop(record_key, 0)
+        self.states.pop(record_key, None)
+        self.data.pop(record_key, None)
+        self.keys.pop(record_key, None)
+        self.touched.pop(record_key, None)
+
+    def _evict(self):
+        """Витісняє найдавніші збережені записи; вони перечитаються з БД при наступному доступі."""
+        for record_key in list(self.touched):
+            if self.memory <= self.memory_limit:
+                break
+            if record_key in self.dirty or record_key in self.flushing:
+                continue
+            self._drop(record_key)
+            FSM_EVICTIONS.inc(reason="lru")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record_key = await self._load(key)
+        self.states[record_key] = state.state if isinstance(state, State) else state
+        self.dirty.add(record_key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record_key = await self._load(key)
+        return self.states[record_key]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record_key = await self._load(key)
+        self.data[record_key] = deepcopy(data)
+        self.dirty.add(record_key)
+        self._resize(record_key, len(json.dumps(data, ensure_ascii=False)) if data else 0)
+        if self.memory > self.memory_limit:
+            self._evict()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record_key = await self._load(key)
+        return deepcopy(self.data[record_key])
+
+    async def get_value(
+        self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None
+    ) -> Optional[Any]:
+        record_key = await self._load(storage_key)
+        return deepcopy(self.data[record_key].get(dict_key, default))
+
+    async def flush(self):
+        if not self.dirty:
+            return
+
+        dirty, self.dirty = self.dirty, set()
+        self.flushing = dirty
+        records = []
+        deleted = []
+
+        for record_key in dirty:
+            state = self.states.get(record_key)
+            data = self.data.get(record_key)
+            if state is None and not data:
+                deleted.append(record_key)
+            else:
+                records.append(
+                    {
+                        "key": record_key,
+                        "state": state,
+                        "data": json.dumps(data or {}, ensure_ascii=False),
+                    }
+                )
+
+        try:
+            await writer.submit(lambda repo: repo.save_fsm(records, deleted))
+        except Exception:
+            self.dirty |= dirty
+            raise
+        finally:
+            self.flushing = set()
+
+    # ---------- EXPIRY ----------
+
+    def _storage_key(self, record_key: str) -> Optional[StorageKey]:
+        """Зворотне до DefaultKeyBuilder(with_bot_id=True, with_destiny=True) для записів лише в БД."""
+        parts = record_key.split(":")
+        if len(parts) != 5:
+            return None
+        _, bot_id, chat_id, user_id, destiny = parts
+        try:
+            return StorageKey(
+                bot_id=int(bot_id), chat_id=int(chat_id), user_id=int(user_id), destiny=destiny
+            )
+        except ValueError:
+            return None
+
+    async def sweep(self):
+        """Видаляє записи без активності довше ttl: спершу в пам'яті, потім лишені в БД."""
+        expired: list[tuple[Optional[StorageKey], Dict[str, Any]]] = []
+        deadline = time.monotonic() - self.ttl
+
+        for record_key, touched in list(self.touched.items()):
+            if touched > deadline:
+                break  # далі лише свіжіші
+            if record_key in self.dirty or record_key in self.flushing:
+                continue
+            state, data = self.states[record_key], self.data[record_key]
+            if state is None and not data:
+                self._drop(record_key)
+                continue
+            # Очищаємо, а не викидаємо: flush видалить рядок з БД, і _load не підхопить стару версію
+            self.states[record_key] = None
+            self.data[record_key] = {}
+            self._resize(record_key, 0)
+            self.dirty.add(record_key)
+            expired.append((self.keys.get(record_key), data))
+
+        # Під self.lock лише читання: writer.submit під ним дав би цикл із хендлером,
+        # що тримає writer.lock і чекає self.lock у _load
+        async with self.lock:
+            async with unit_of_work() as repo:
+                records = await repo.get_stale_fsm(utcnow() - timedelta(seconds=self.ttl))
+        stale = [record for record in records if record.key not in self.data]
+        if stale:
+            keys = [record.key for record in stale]
+            await writer.submit(lambda repo: repo.save_fsm([], keys))
+
+            # Поки видаляли, запис могли підвантажити: змінений живе далі, решту прибираємо з пам'яті
+            alive = {key for key in keys if key in self.dirty or key in self.flushing}
+            for key in keys:
+                if key in self.data and key not in alive:
+                    self._drop(key)
+            stale = [record for record in stale if record.key not in alive]
+
+        for record in stale:
+            data = json.loads(record.data) if record.data else {}
+            if record.state is not None or data:
+                expired.append((self._storage_key(record.key), data))
+
+        if expired:
+            FSM_EVICTIONS.inc(len(expired), reason="ttl")
+            logger.info("FSM sweep: %s expired records", len(expired))
+
+        if self.on_expire is None:
+            return
+        for key, data in expired:
+            if key is None:
+                continue
+            try:
+                await self.on_expire(key, data)
+            except Exception:
+                logger.exception("FSM on_expire failed")
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("FSM sweep failed")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("FSM flush failed")
+
+    async def start(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_loop())
+        if self.sweep_task is None and self.ttl:
+            self.sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def close(self) -> None:
+        for task in (self.flush_task, self.sweep_task):
+            if task is not None:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        self.flush_task = self.sweep_task = None
+        await self.flush()
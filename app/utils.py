@@ -1,19 +1,274 @@
 import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Iterable, Mapping, Optional
 
+# Символ або ISO-код валюти перед сумою чи після неї: $1,299 / 1 299 € / 45 USD / EUR 12,50
+CURRENCY_SIGNS = {"$": "USD", "€": "EUR", "£": "GBP"}
+_CURRENCY = r"[$€£]|(?<![A-Za-z])(?:USD|EUR|GBP)(?![A-Za-z])"
+# Тисячі — групи по 3 цифри через кому, крапку чи нерозривний пробіл; дробова частина — 1-2 цифри.
+# Звичайний пробіл як роздільник тисяч — лише перед валютою-суфіксом: у "$25 100 шт" сума 25
+_AMOUNT = r"\d{1,3}(?:[,.\u00a0\u202f]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?"
+_AMOUNT_SUFFIX = r"\d{1,3}(?:[,.\u00a0\u202f ]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?"
+# Знак між двома числами ("5 $ 2 шт") — суфікс першого; префіксом лише прилиплий до суми ("5 $20")
+PRICE_PATTERN = re.compile(
+    rf"(?P<prefix>{_CURRENCY})\s?(?P<amount>{_AMOUNT})(?![\d])"
+    rf"|(?<![\d.,])(?P<amount_suffix>{_AMOUNT_SUFFIX})\s?(?P<suffix>{_CURRENCY})(?!\d)"
+)
+# Назви валют у таблиці rates, які зводяться до ISO-коду
+CURRENCY_ALIASES = {
+    "$": "USD",
+    "US$": "USD",
+    "ДОЛАР": "USD",
+    "ДОЛАРИ": "USD",
+    "€": "EUR",
+    "EURO": "EUR",
+    "ЄВРО": "EUR",
+    "£": "GBP",
+    "ФУНТ": "GBP",
+    "ФУНТИ": "GBP",
+}
+PRICE_FORMAT = "{} грн + вага\n"
+TEXT_SEPARATOR = "\x00"
+CHANNEL_ID_PATTERN = re.compile(r"^-?\d+$")
+SCHEDULE_PATTERN = re.compile(
+    r"^(?:(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?\s+)?(\d{1,2})[:.](\d{2})$"
+)
 
-def replace_prices_with_uah(text, exchange_rate):
-    pattern = r"\$(\d{1,3}(?:,\d{3})*)(?:[.,]\d{2})?"
 
-    def convert_to_uah(match):
-        dollars = float(match.group().replace("$", "").replace(",", "."))
-        price_in_uah = round(dollars * exchange_rate)
+def normalize_currency(name: str) -> Optional[str]:
+    """Назва валюти -> ISO-код (USD, EUR, ...) або None, якщо не розпізнано."""
+    name = name.strip().upper()
+    if name in CURRENCY_ALIASES:
+        return CURRENCY_ALIASES[name]
+    if re.fullmatch(r"[A-Z]{3}", name):
+        return name
+    return None
 
-        return f"{price_in_uah} грн + вага\n"
 
-    return re.sub(pattern, convert_to_uah, text)
+def parse_amount(raw: str) -> float:
+    """1,299 / 1.299 / 1 299 -> 1299; 12,50 / 1.299,50 / 1,299.50 -> дріб."""
+    raw = re.sub(r"[\u00a0\u202f ]", "", raw)
+    last = max(raw.rfind(","), raw.rfind("."))
+    if last == -1:
+        return float(raw)
+    # Після останнього роздільника 3 цифри — це тисячі, інакше — дробова частина
+    if len(raw) - last - 1 == 3:
+        return float(re.sub(r"[,.]", "", raw))
+    return float(re.sub(r"[,.]", "", raw[:last]) + "." + raw[last + 1 :])
+
+
+@dataclass(frozen=True)
+class PriceTemplate:
+    # parts завжди на один довший за amounts: текст, ціна, текст, ціна, ..., текст
+    parts: tuple[str, ...]
+    amounts: tuple[float, ...]
+    # ISO-код валюти кожної суми (USD, EUR, ...), паралельно до amounts
+    currencies: tuple[str, ...] = ()
+    # Сума як у тексті ("$10", "10 €"): лишається без змін, якщо для її валюти немає курсу
+    raw: tuple[str, ...] = ()
+
+    def _rates(
+        self, exchange_rate: Optional[float], rates: Optional[Mapping[str, float]]
+    ) -> list[Optional[float]]:
+        # Кожна сума — лише за курсом своєї валюти; exchange_rate — для шаблонів без валют
+        if len(self.currencies) != len(self.amounts):
+            return [exchange_rate] * len(self.amounts)
+        rates = rates or {}
+        return [rates.get(currency) for currency in self.currencies]
+
+    def unresolved(self, rates: Mapping[str, float]) -> list[str]:
+        """Суми, для валюти яких немає курсу: їх не перераховуємо, а показуємо адміну."""
+        return [
+            raw
+            for raw, rate in zip(self.raw or self.currencies, self._rates(None, rates))
+            if rate is None
+        ]
+
+    def resolves(self, rates: Mapping[str, float]) -> bool:
+        """Чи всі суми мають курс за своєю валютою (тоді вибирати курс вручну не треба)."""
+        return len(self.currencies) == len(self.amounts) and not self.unresolved(rates)
+
+    def render(
+        self,
+        exchange_rate: Optional[float],
+        price_format: str = PRICE_FORMAT,
+        rates: Optional[Mapping[str, float]] = None,
+    ) -> str:
+        out = [self.parts[0]]
+        for amount, raw, rate, part in zip(
+            self.amounts, self.raw, self._rates(exchange_rate, rates), self.parts[1:]
+        ):
+            out.append(raw if rate is None else price_format.format(round(amount * rate)))
+            out.append(part)
+        return "".join(out)
+
+    def preview(
+        self,
+        exchange_rate: Optional[float],
+        limit: int = 3,
+        rates: Optional[Mapping[str, float]] = None,
+    ) -> str:
+        prices = [
+            "?" if rate is None else str(round(amount * rate))
+            for amount, rate in zip(self.amounts[:limit], self._rates(exchange_rate, rates))
+        ]
+        if len(self.amounts) > limit:
+            prices.append("...")
+        return " / ".join(prices)
+
+
+class PriceConverter:
+    """Один раз розбирає текст на шаблон, далі рендерить його для будь-якого курсу.
+
+    >>> converter.tokenize("$25 100 шт").amounts
+    (25.0,)
+    >>> converter.tokenize("Ціна 5 $ 2 шт").amounts
+    (5.0,)
+    >>> converter.tokenize("Розмір 5 $20").amounts
+    (20.0,)
+    >>> converter.tokenize("25 100 € / $1\u00a0299").amounts
+    (25100.0, 1299.0)
+    >>> converter.convert("$10 / 10 €", None, {"USD": 41.5})
+    '415 грн + вага\\n / 10 €'
+    """
+
+    def __init__(self, pattern: re.Pattern = PRICE_PATTERN, price_format: str = PRICE_FORMAT):
+        self.pattern = pattern
+        self.price_format = price_format
+        self.tokenize = lru_cache(maxsize=256)(self._tokenize)
+
+    def _tokenize(self, text: str) -> PriceTemplate:
+        parts = []
+        amounts = []
+        currencies = []
+        raw = []
+        last = 0
+
+        # Один прохід: сума і її валюта розпізнаються тим самим збігом
+        for match in self.pattern.finditer(text):
+            amount = match.group("amount") or match.group("amount_suffix")
+            currency = match.group("prefix") or match.group("suffix")
+            try:
+                amount = parse_amount(amount)
+            except ValueError:
+                continue
+            parts.append(text[last : match.start()])
+            amounts.append(amount)
+            currencies.append(CURRENCY_SIGNS.get(currency, currency))
+            raw.append(match.group())
+            last = match.end()
+
+        parts.append(text[last:])
+        return PriceTemplate(
+            parts=tuple(parts),
+            amounts=tuple(amounts),
+            currencies=tuple(currencies),
+            raw=tuple(raw),
+        )
+
+    def convert(
+        self,
+        text: str,
+        exchange_rate: Optional[float],
+        rates: Optional[Mapping[str, float]] = None,
+    ) -> str:
+        return self.tokenize(text).render(exchange_rate, self.price_format, rates)
+
+    def convert_many(
+        self,
+        texts: Iterable[str],
+        exchange_rate: Optional[float],
+        rates: Optional[Mapping[str, float]] = None,
+    ) -> list[str]:
+        # Всі підписи одним проходом регулярки
+        texts = list(texts)
+        if not texts:
+            return []
+        joined = self._tokenize(TEXT_SEPARATOR.join(texts))
+        return joined.render(exchange_rate, self.price_format, rates).split(TEXT_SEPARATOR)
+
+
+converter = PriceConverter()
+
+
+def replace_prices_with_uah(text, exchange_rate, rates=None):
+    return converter.convert(text, exchange_rate, rates)
+
+
+class Highlighter:
+    """Виділяє всі слова набору за один прохід, не чіпаючи теги та вже жирний текст."""
+
+    def __init__(self, words: Iterable[str]):
+        words = sorted({word for word in words if word}, key=len, reverse=True)
+        self.words = tuple(words)
+        alternation = "|".join(re.escape(word) for word in words) or r"(?!)"
+        self.pattern = re.compile(
+            rf"(<b>.*?</b>|<[^>]*>|&\w+;)|(?<!\w)({alternation})(?!\w)", re.S
+        )
+        # Для простого тексту без розмітки (чернетка зберігає жирне окремими проміжками)
+        self.plain_pattern = re.compile(rf"(?<!\w)({alternation})(?!\w)")
+
+    def _replace(self, match: re.Match) -> str:
+        if match.group(1):
+            return match.group(1)
+        return f"<b>{match.group(2)}</b>"
+
+    def highlight(self, text: str) -> str:
+        return self.pattern.sub(self._replace, text)
+
+    def spans(self, text: str) -> list[tuple[int, int]]:
+        return [match.span() for match in self.plain_pattern.finditer(text)]
+
+
+@lru_cache(maxsize=128)
+def get_highlighter(words: frozenset[str]) -> Highlighter:
+    return Highlighter(words)
+
+
+def split_words(text: str) -> frozenset[str]:
+    return frozenset(word.strip() for word in re.split(r"[,\n]", text) if word.strip())
+
 
 def bold_words(words, sentence):
-    # Створюємо регулярний вираз для кожного слова, яке потрібно знайти
-    for word in words:
-        sentence = re.sub(rf'\b({re.escape(word)})\b', r'<b>\1</b>', sentence)
-    return sentence
+    return get_highlighter(frozenset(words)).highlight(sentence)
+
+
+def parse_channel_ids(text: str) -> tuple[list[int], list[str]]:
+    """ID каналів через пробіл, кому або з нового рядка -> (коректні, некоректні)."""
+    valid = []
+    invalid = []
+    for token in re.split(r"[\s,;]+", text or ""):
+        if not token:
+            continue
+        if CHANNEL_ID_PATTERN.match(token):
+            valid.append(int(token))
+        else:
+            invalid.append(token)
+    return list(dict.fromkeys(valid)), invalid
+
+
+def parse_schedule_time(text: str, now: datetime) -> Optional[datetime]:
+    """ГГ:ХХ (сьогодні, або завтра, якщо вже минуло), ДД.ММ ГГ:ХХ чи ДД.ММ.РРРР ГГ:ХХ у поясі now."""
+    match = SCHEDULE_PATTERN.match(text.strip())
+    if not match:
+        return None
+
+    day, month, year, hour, minute = match.groups()
+    try:
+        run_at = now.replace(
+            year=int(year) if year else now.year,
+            month=int(month) if month else now.month,
+            day=int(day) if day else now.day,
+            hour=int(hour),
+            minute=int(minute),
+            second=0,
+            microsecond=0,
+        )
+    except ValueError:
+        return None
+
+    if not day and run_at <= now:
+        run_at += timedelta(days=1)
+    return run_at
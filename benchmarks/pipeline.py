@@ -0,0 +1,392 @@
+"""Пропускна здатність конвеєра convert -> select_rate -> send_to_groups без мережі:
+синтетичні Update через справжній Dispatcher, router і middlewares, фейкова сесія Bot API.
+
+    python benchmarks/pipeline.py --flows 300 --concurrency 20 --channels 20
+    python benchmarks/pipeline.py --compare benchmarks/results/<commit>.json
+
+Результати пишуться в benchmarks/results/<commit>.json для порівняння між комітами.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP_DIR = tempfile.mkdtemp(prefix="bench_pipeline_")
+os.environ["DB_URL"] = f"sqlite+aiosqlite:///{TMP_DIR}/pipeline.db"
+os.environ.setdefault("FSM_FLUSH_INTERVAL", "1")
+sys.path.insert(0, ROOT)
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram import methods  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Message, Update  # noqa: E402
+
+import app.database as db  # noqa: E402
+from app.handlers import album_middleware, router  # noqa: E402
+from app.middlewares import DataBaseSession, MetricsMiddleware  # noqa: E402
+from app.outbox import OutboxWorker  # noqa: E402
+from app.storage import SQLAlchemyStorage  # noqa: E402
+from app.utils import bold_words, converter, replace_prices_with_uah  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+CAPTION = "\n".join(
+    [
+        "Nike Air Max 90 — $120",
+        "Adidas Samba OG $89.99",
+        "New Balance 550 $1,299",
+        "Розміри: 40-45, доставка 10-14 днів",
+    ]
+)
+BOLD_WORDS = ["Nike", "Adidas", "New Balance", "доставка"]
+
+ids = itertools.count(1_000)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def short_path(filename: str) -> str:
+    if filename.startswith(ROOT):
+        return os.path.relpath(filename, ROOT)
+    return "/".join(filename.split(os.sep)[-3:])
+
+
+def latency_stats(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.mean(values) * 1000, 3) if values else 0.0,
+    }
+
+
+class FakeSession(BaseSession):
+    """Відповідає на виклики Bot API в процесі, з опційною затримкою."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    def _message(self, bot: Bot, chat_id, text=None) -> Message:
+        return Message.model_validate(
+            {
+                "message_id": next(ids),
+                "date": 0,
+                "chat": {"id": chat_id or 1, "type": "private"},
+                "text": text,
+            }
+        ).as_(bot)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, methods.SendMediaGroup):
+            return [self._message(bot, method.chat_id) for _ in method.media]
+        if isinstance(method, (methods.SendMessage, methods.EditMessageText)):
+            return self._message(bot, method.chat_id, method.text)
+        if isinstance(method, methods.EditMessageCaption):
+            return self._message(bot, method.chat_id, method.caption)
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+
+def make_update(**payload) -> Update:
+    return Update.model_validate({"update_id": next(ids), **payload})
+
+
+def photo_update(user_id: int, caption: str = None, media_group_id: str = None) -> Update:
+    message = {
+        "message_id": next(ids),
+        "date": 0,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+        "photo": [
+            {"file_id": f"photo{next(ids)}", "file_unique_id": "u", "width": 1, "height": 1}
+        ],
+    }
+    if caption:
+        message["caption"] = caption
+    if media_group_id:
+        message["media_group_id"] = media_group_id
+    return make_update(message=message)
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    return make_update(
+        callback_query={
+            "id": str(next(ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": next(ids),
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "bench",
+            },
+        }
+    )
+
+
+class Pipeline:
+    def __init__(self, args):
+        self.args = args
+        self.session = FakeSession(latency=args.api_latency / 1000)
+        self.bot = Bot("42:BENCH", session=self.session, default=DefaultBotProperties(parse_mode="HTML"))
+        self.storage = SQLAlchemyStorage()
+        self.outbox = OutboxWorker(self.bot)
+        self.dp = Dispatcher(storage=self.storage)
+        self.dp.include_router(router)
+        self.dp["outbox"] = self.outbox
+        self.dp.update.middleware(MetricsMiddleware())
+        self.dp.update.middleware(DataBaseSession(session_pool=db.session_maker))
+        self.latencies: dict[str, list[float]] = {}
+        self.user_ids = itertools.count(100)
+
+    async def setup(self):
+        await db.create_db()
+        async with db.unit_of_work() as repo:
+            await repo.add_rate("USD", 41.5)
+            await repo.add_channels([-(1_000_000 + i) for i in range(self.args.channels)])
+        await db.load_rate_cache()
+        album_middleware.collector.latency = self.args.album_latency / 1000
+        await self.storage.start()
+        if self.args.outbox:
+            await self.outbox.start()
+
+    async def close(self):
+        if self.args.outbox:
+            await self.outbox.stop()
+        await self.storage.close()
+        await db.writer.close()
+        await db.engine.dispose()
+
+    async def _timed(self, stage: str, *updates: Update):
+        # Частини альбому надходять одночасно; час — до завершення хендлера
+        started = time.perf_counter()
+        await asyncio.gather(*(self.dp.feed_update(self.bot, update) for update in updates))
+        self.latencies.setdefault(stage, []).append(time.perf_counter() - started)
+
+    async def _admin(self, user_id: int):
+        async with db.unit_of_work() as repo:
+            await repo.upsert_user(user_id)
+            await repo.set_admin(user_id, True)
+
+    async def flow(self, album_size: int):
+        user_id = next(self.user_ids)
+        await self._admin(user_id)
+
+        if album_size > 1:
+            group = f"g{user_id}"
+            updates = [
+                photo_update(user_id, CAPTION if idx == 0 else None, media_group_id=group)
+                for idx in range(album_size)
+            ]
+            await self._timed("convert_album", *updates)
+        else:
+            await self._timed("convert_photo", photo_update(user_id, CAPTION))
+
+        await self._timed("select_rate", callback_update(user_id, "select_rate_1"))
+        await self._timed("send_to_groups", callback_update(user_id, "send_to_groups"))
+
+    async def run(self, flows: int) -> dict:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        updates_before = self.session.calls
+
+        async def one(index: int):
+            async with semaphore:
+                album_size = 10 if index % self.args.album_every == 0 else 1
+                await self.flow(album_size)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(flows)))
+        elapsed = time.perf_counter() - started
+
+        updates = sum(len(values) for values in self.latencies.values())
+        # кожен альбом = 10 апдейтів
+        updates += 9 * len(self.latencies.get("convert_album", []))
+        return {
+            "flows": flows,
+            "updates": updates,
+            "seconds": round(elapsed, 3),
+            "updates_per_sec": round(updates / elapsed, 1),
+            "flows_per_sec": round(flows / elapsed, 1),
+            "api_calls": self.session.calls - updates_before,
+            "stages": {stage: latency_stats(values) for stage, values in self.latencies.items()},
+        }
+
+    async def drain(self) -> float:
+        """Час, поки outbox не розішле всі поставлені розсилки."""
+        started = time.perf_counter()
+        while True:
+            async with db.unit_of_work() as repo:
+                due = await repo.next_outbox_due()
+            if due is None and self.outbox.queue.empty():
+                return round(time.perf_counter() - started, 3)
+            await asyncio.sleep(0.05)
+
+
+async def pipeline_bench(args) -> dict:
+    pipeline = Pipeline(args)
+    await pipeline.setup()
+    try:
+        await pipeline.run(args.warmup)
+        pipeline.latencies.clear()
+        result = await pipeline.run(args.flows)
+        if args.outbox:
+            result["outbox_drain_seconds"] = await pipeline.drain()
+
+        if args.allocations:
+            pipeline.latencies.clear()
+            tracemalloc.start(25)
+            before = tracemalloc.take_snapshot()
+            await pipeline.run(args.allocations)
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            stats = after.compare_to(before, "filename")
+            allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+            result["allocations"] = {
+                "flows": args.allocations,
+                "peak_kib": round(peak / 1024, 1),
+                "net_kib_per_flow": round(allocated / 1024 / args.allocations, 2),
+                "top": [
+                    {
+                        "file": short_path(stat.traceback[0].filename),
+                        "size_diff_kib": round(stat.size_diff / 1024, 1),
+                        "count_diff": stat.count_diff,
+                    }
+                    for stat in stats[:5]
+                ],
+            }
+        return result
+    finally:
+        await pipeline.close()
+
+
+def micro_bench(args) -> dict:
+    rate = 41.5
+    words = BOLD_WORDS
+    lines = replace_prices_with_uah(CAPTION, rate).split("\n")
+
+    def measure(func, number: int) -> float:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        return round(best / number * 1e6, 3)  # мкс на виклик
+
+    return {
+        "replace_prices_with_uah_us": measure(lambda: replace_prices_with_uah(CAPTION, rate), args.micro),
+        "replace_prices_cold_us": measure(lambda: converter._tokenize(CAPTION).render(rate), args.micro),
+        "bold_words_line_us": measure(lambda: bold_words(words, lines[0]), args.micro),
+        "bold_words_caption_us": measure(lambda: [bold_words(words, line) for line in lines], args.micro),
+    }
+
+
+def git_commit() -> tuple[str, bool]:
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+        dirty = bool(
+            subprocess.check_output(
+                ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True
+            ).strip()
+        )
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def compare(current: dict, previous: dict):
+    def flatten(data: dict, prefix: str = "") -> dict:
+        out = {}
+        for key, value in data.items():
+            name = f"{prefix}{key}"
+            if isinstance(value, dict):
+                out.update(flatten(value, f"{name}."))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                out[name] = value
+        return out
+
+    old = flatten({"pipeline": previous["pipeline"], "micro": previous["micro"]})
+    new = flatten({"pipeline": current["pipeline"], "micro": current["micro"]})
+    print(f"\nvs {previous['commit']}:")
+    for name in sorted(old.keys() & new.keys()):
+        if old[name]:
+            change = (new[name] - old[name]) / old[name] * 100
+            print(f"  {name:<48} {old[name]:>12} -> {new[name]:>12} ({change:+.1f}%)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flows", type=int, default=300, help="convert -> select_rate -> send_to_groups")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--album-every", type=int, default=3, help="кожен N-й потік — альбом з 10 фото")
+    parser.add_argument("--album-latency", type=float, default=300, help="мс, як у AlbumMiddleware")
+    parser.add_argument("--api-latency", type=float, default=0, help="мс на виклик Bot API")
+    parser.add_argument("--allocations", type=int, default=50, help="потоків під tracemalloc (0 — вимкнути)")
+    parser.add_argument("--micro", type=int, default=2000, help="ітерацій мікробенчмарків")
+    parser.add_argument(
+        "--outbox",
+        action="store_true",
+        help="запустити воркери outbox і виміряти час до кінця розсилки (впирається в ліміти на канал)",
+    )
+    parser.add_argument("--output", help="файл результатів (за замовчуванням results/<commit>.json)")
+    parser.add_argument("--compare", help="JSON попереднього запуску для порівняння")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit()
+    result = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "micro": micro_bench(args),
+        "pipeline": await pipeline_bench(args),
+    }
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = json.load(file)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(result, file, indent=2, ensure_ascii=False)
+    print(f"\nSaved to {output}")
+
+    if previous:
+        compare(result, previous)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""Порівняння записів у SQLite: як раніше (сесія + commit на кожен виклик)
+проти WAL/pragma + SingleWriter з пакетними commit.
+
+    python benchmarks/sqlite_writes.py --ops 2000 --concurrency 50 --readers 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_sqlite_")
+os.environ["DB_URL"] = f"sqlite+aiosqlite:///{TMP_DIR}/tuned.db"
+os.environ.setdefault("SQLITE_PRAGMAS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.dialects.sqlite import insert  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+
+import app.database as db  # noqa: E402
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def run_load(write, read, ops: int, concurrency: int, readers: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    reads = 0
+    done = asyncio.Event()
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await write(i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    async def reader():
+        nonlocal reads
+        while not done.is_set():
+            await read()
+            reads += 1
+
+    reader_tasks = [asyncio.create_task(reader()) for _ in range(readers)]
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(ops)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await asyncio.gather(*reader_tasks)
+
+    return {
+        "ops_per_sec": round(ops / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "errors": errors,
+        "reads": reads,
+    }
+
+
+async def baseline(args) -> dict:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{TMP_DIR}/baseline.db")
+    session_maker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(db.Base.metadata.create_all)
+
+    async def write(i: int):
+        async with session_maker() as session:
+            async with session.begin():
+                query = insert(db.User).values(tg_id=i).on_conflict_do_nothing()
+                await session.execute(query)
+
+    async def read():
+        async with session_maker() as session:
+            await session.execute(select(func.count(db.User.id)))
+
+    try:
+        return await run_load(write, read, args.ops, args.concurrency, args.readers)
+    finally:
+        await engine.dispose()
+
+
+async def tuned(args) -> dict:
+    await db.create_db()
+
+    async def write(i: int):
+        await db.writer.submit(lambda repo: repo.upsert_user(i))
+
+    async def read():
+        async with db.session_maker() as session:
+            await session.execute(select(func.count(db.User.id)))
+
+    try:
+        return await run_load(write, read, args.ops, args.concurrency, args.readers)
+    finally:
+        await db.writer.close()
+        await db.engine.dispose()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--readers", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.ops} writes, concurrency {args.concurrency}, {args.readers} readers ({TMP_DIR})")
+    for name, bench in (("baseline", baseline), ("wal+writer", tuned)):
+        print(f"{name:>12}: {await bench(args)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
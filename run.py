@@ -1,51 +1,147 @@
 import asyncio
 import logging
 import os
+import signal
+from functools import partial
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from dotenv import load_dotenv
-from app.middlewares import DataBaseSession
+from app.logs import setup_logging
+from app.middlewares import ConcurrencyLimit, DataBaseSession, LogContextMiddleware, MetricsMiddleware
+from app.metrics import MetricsSession, registry, start_metrics_server
 from app.database import session_maker
 from app.common import private
-from app.database import create_db, drop_db
-from app.handlers import router
+from app.database import load_rate_cache, prepare_db, writer
+from app.draft import notify_expired
+from app.handlers import album_middleware, router
+from app.outbox import OutboxWorker
+from app.scheduler import Scheduler
+from app.storage import SQLAlchemyStorage
 
 load_dotenv()
 
 
-# LOGGING
-logging.basicConfig(
-    level=logging.INFO,  # Logging level
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("bot.log", encoding="utf-8"),
-        logging.StreamHandler(),
-    ],
-)
+# LOGGING: запис у файл/консоль у фоновому потоці, ротація (див. app/logs.py)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
 
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", 50))
+# Інший Bot API сервер: локальний telegram-bot-api або tools/fake_telegram.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    # Ліміт на спостерігачах роутера, після AlbumMiddleware: поки альбом дозбирується, слот не зайнятий
+    limit = ConcurrencyLimit(WEBHOOK_MAX_CONCURRENCY)
+    router.message.middleware(limit)
+    router.callback_query.middleware(limit)
+
+    async def on_startup(bot: Bot):
+        if WEBHOOK_BASE_URL:
+            await bot.set_webhook(
+                f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=WEBHOOK_MAX_CONCURRENCY,
+            )
+
+    dp.startup.register(on_startup)
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()  # dp.startup
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()  # dp.shutdown: воркери, FSM, сесія бота
+
+
 async def main():
-    await create_db()
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        # Без секрету будь-хто, хто знає URL, може підсовувати боту апдейти
+        raise RuntimeError("WEBHOOK_SECRET is required when BOT_MODE=webhook")
+
+    await prepare_db()
+    await load_rate_cache()
     
+    if TELEGRAM_API_URL:
+        session = MetricsSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        logger.info("Using Bot API server %s", TELEGRAM_API_URL)
+    else:
+        session = MetricsSession()
+
     bot = Bot(
         token=os.getenv("BOT_TOKEN"),
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
 
-    dp = Dispatcher()
+    outbox = OutboxWorker(bot)
+    # Відкладені пости: прокидається лише до найближчого завдання
+    scheduler = Scheduler(bot, outbox)
+
+    storage = SQLAlchemyStorage(on_expire=partial(notify_expired, bot))
+    registry.callback(
+        "bot_fsm_memory_bytes", "FSM data held in memory (JSON bytes)", lambda: storage.memory
+    )
+
+    dp = Dispatcher(storage=storage)
     dp.include_routers(router)
+    dp["outbox"] = outbox
+    dp["scheduler"] = scheduler
+    dp.startup.register(storage.start)
+    dp.startup.register(outbox.start)
+    dp.startup.register(album_middleware.start)
+    dp.shutdown.register(album_middleware.stop)
+    dp.startup.register(scheduler.start)
+    dp.shutdown.register(scheduler.stop)
+    dp.shutdown.register(outbox.stop)
+    dp.shutdown.register(writer.close)
 
+    dp.update.outer_middleware(LogContextMiddleware())
+    dp.update.middleware(MetricsMiddleware())
     dp.update.middleware(DataBaseSession(session_pool=session_maker))
 
-    await bot.delete_webhook(drop_pending_updates=True)
+    metrics_runner = await start_metrics_server()
+    if metrics_runner:
+        dp.shutdown.register(metrics_runner.cleanup)
+
     await bot.set_my_commands(
         commands=private, scope=types.BotCommandScopeAllPrivateChats()
     )
-    await dp.start_polling(bot)
+
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot)
     
 
 if __name__ == "__main__":
@@ -0,0 +1,269 @@
+"""Локальна заміна Bot API для навантажувальних прогонів і розсилок на сотні каналів.
+
+    python tools/fake_telegram.py --port 8081 --latency 50 --chat-rate 1 --retry-rate 0.01
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python run.py
+
+Апдейти для getUpdates: POST /fake/updates (JSON-об'єкт, масив або JSON Lines),
+напр. tools/post_updates.py updates.jsonl --url http://127.0.0.1:8081/fake/updates.
+Статистика викликів: GET /fake/stats.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FloodLimiter:
+    """Token bucket на чат + глобальний; на відміну від клієнтського не чекає, а повертає retry_after."""
+
+    def __init__(self, chat_rate: float, chat_burst: float, global_rate: float):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_rate = global_rate
+        self.buckets: dict[int, float] = {}
+        self.global_tokens = global_rate
+        self.updated: dict[int, float] = {}
+        self.global_updated = time.monotonic()
+
+    def check(self, chat_id: int) -> float:
+        """0 — можна надсилати (токени списано), інакше через скільки секунд."""
+        now = time.monotonic()
+
+        if self.global_rate:
+            elapsed = now - self.global_updated
+            self.global_tokens = min(self.global_rate, self.global_tokens + elapsed * self.global_rate)
+            self.global_updated = now
+            if self.global_tokens < 1:
+                return (1 - self.global_tokens) / self.global_rate
+
+        if self.chat_rate:
+            elapsed = now - self.updated.get(chat_id, now)
+            tokens = min(self.chat_burst, self.buckets.get(chat_id, self.chat_burst) + elapsed * self.chat_rate)
+            self.buckets[chat_id] = tokens
+            self.updated[chat_id] = now
+            if tokens < 1:
+                return (1 - tokens) / self.chat_rate
+            self.buckets[chat_id] = tokens - 1
+
+        if self.global_rate:
+            self.global_tokens -= 1
+        return 0.0
+
+
+class FakeTelegram:
+    SEND_METHODS = {"sendmessage", "sendmediagroup", "sendphoto"}
+
+    def __init__(self, args):
+        self.args = args
+        self.limiter = FloodLimiter(args.chat_rate, args.chat_burst, args.global_rate)
+        self.message_ids = itertools.count(1)
+        self.update_ids = itertools.count(1)
+        self.updates: list[dict] = []
+        self.new_updates = asyncio.Event()
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.sent_per_chat: Counter = Counter()
+
+    # ---------- HELPERS ----------
+
+    @staticmethod
+    async def params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        data = dict(await request.post())
+        # aiogram шле вкладені об'єкти (media, reply_markup) JSON-рядками
+        for key in ("media", "reply_markup", "commands", "message_ids", "allowed_updates"):
+            if isinstance(data.get(key), str):
+                data[key] = json.loads(data[key])
+        return data
+
+    @staticmethod
+    def ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    def error(self, method: str, code: int, description: str, **parameters) -> web.Response:
+        self.errors[f"{method}:{code}"] += 1
+        payload = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return web.json_response(payload, status=code)
+
+    def message(self, chat_id, **fields) -> dict:
+        chat_id = int(chat_id)
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel" if chat_id < 0 else "private"},
+            **{key: value for key, value in fields.items() if value is not None},
+        }
+
+    @staticmethod
+    def photo(file_id: str) -> list[dict]:
+        return [{"file_id": file_id, "file_unique_id": file_id[-16:], "width": 1280, "height": 1280}]
+
+    # ---------- HTTP ----------
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        name = method.lower()
+        self.calls[method] += 1
+        params = await self.params(request)
+
+        if self.args.latency or self.args.jitter:
+            await asyncio.sleep((self.args.latency + random.uniform(0, self.args.jitter)) / 1000)
+
+        if name in self.SEND_METHODS or name.startswith("edit"):
+            if random.random() < self.args.retry_rate:
+                retry_after = self.args.retry_after
+                return self.error(
+                    method, 429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after
+                )
+            wait = self.limiter.check(int(params.get("chat_id", 0)))
+            if wait:
+                retry_after = max(1, math.ceil(wait))
+                return self.error(
+                    method, 429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after
+                )
+
+        handler = getattr(self, f"api_{name}", None)
+        if handler is None:
+            return self.error(method, 404, "Not Found: method not found")
+        return await handler(params)
+
+    async def api_getme(self, params):
+        return self.ok(
+            {"id": 42, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        )
+
+    async def api_getupdates(self, params):
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+
+        limit = int(params.get("limit") or 100)
+        return self.ok(self.updates[:limit])
+
+    async def api_sendmessage(self, params):
+        self.sent_per_chat[int(params["chat_id"])] += 1
+        return self.ok(self.message(params["chat_id"], text=params.get("text")))
+
+    async def api_sendphoto(self, params):
+        self.sent_per_chat[int(params["chat_id"])] += 1
+        return self.ok(
+            self.message(
+                params["chat_id"], photo=self.photo(str(params.get("photo"))), caption=params.get("caption")
+            )
+        )
+
+    async def api_sendmediagroup(self, params):
+        media = params.get("media") or []
+        if not 1 <= len(media) <= 10:
+            return self.error("sendMediaGroup", 400, "Bad Request: wrong number of media")
+        self.sent_per_chat[int(params["chat_id"])] += 1
+        group = str(next(self.message_ids))
+        return self.ok(
+            [
+                self.message(
+                    params["chat_id"],
+                    media_group_id=group,
+                    photo=self.photo(item["media"]),
+                    caption=item.get("caption"),
+                )
+                for item in media
+            ]
+        )
+
+    async def api_editmessagetext(self, params):
+        return self.ok(
+            self.message(params.get("chat_id", 0), text=params.get("text"))
+            | {"message_id": int(params.get("message_id", 0))}
+        )
+
+    async def api_editmessagecaption(self, params):
+        return self.ok(
+            self.message(params.get("chat_id", 0), caption=params.get("caption"))
+            | {"message_id": int(params.get("message_id", 0))}
+        )
+
+    async def api_answercallbackquery(self, params):
+        return self.ok(True)
+
+    async def api_deletemessage(self, params):
+        return self.ok(True)
+
+    async def api_deletemessages(self, params):
+        return self.ok(True)
+
+    async def api_setmycommands(self, params):
+        return self.ok(True)
+
+    async def api_deletewebhook(self, params):
+        return self.ok(True)
+
+    async def api_setwebhook(self, params):
+        return self.ok(True)
+
+    async def inject(self, request: web.Request) -> web.Response:
+        content = (await request.text()).strip()
+        try:
+            updates = json.loads(content)
+        except json.JSONDecodeError:
+            updates = [json.loads(line) for line in content.splitlines() if line.strip()]
+        if isinstance(updates, dict):
+            updates = [updates]
+
+        for update in updates:
+            self.updates.append({**update, "update_id": next(self.update_ids)})
+        self.new_updates.set()
+        return web.json_response({"queued": len(updates), "pending": len(self.updates)})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "calls": dict(self.calls),
+                "errors": dict(self.errors),
+                "chats": len(self.sent_per_chat),
+                "sent": sum(self.sent_per_chat.values()),
+                "pending_updates": len(self.updates),
+            }
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=20 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_post("/fake/updates", self.inject)
+        app.router.add_get("/fake/stats", self.stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0, help="мс на кожен виклик")
+    parser.add_argument("--jitter", type=float, default=0, help="мс випадкової добавки до latency")
+    parser.add_argument("--retry-rate", type=float, default=0, help="ймовірність випадкової 429")
+    parser.add_argument("--retry-after", type=int, default=3, help="retry_after для випадкових 429")
+    parser.add_argument("--chat-rate", type=float, default=1, help="повідомлень/с на чат (0 — без ліміту)")
+    parser.add_argument("--chat-burst", type=float, default=3)
+    parser.add_argument("--global-rate", type=float, default=30, help="повідомлень/с на бота (0 — без ліміту)")
+    args = parser.parse_args()
+
+    web.run_app(FakeTelegram(args).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
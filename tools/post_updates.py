@@ -0,0 +1,72 @@
+"""Відправляє записані апдейти на локальний webhook.
+
+    python tools/post_updates.py updates.jsonl --url http://127.0.0.1:8080/webhook
+
+Файл: JSON-об'єкт апдейту, JSON-масив апдейтів або JSON Lines.
+Секрет береться з WEBHOOK_SECRET (.env), якщо не передано --secret.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from aiohttp import ClientSession
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as file:
+        content = file.read().strip()
+
+    if content.startswith("["):
+        return json.loads(content)
+    if "\n" in content:
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+    return [json.loads(content)]
+
+
+async def main():
+    default_url = "http://127.0.0.1:{}{}".format(
+        os.getenv("WEBHOOK_PORT", 8080), os.getenv("WEBHOOK_PATH", "/webhook")
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--url", default=default_url)
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    updates = load_updates(args.path)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses: dict[int, int] = {}
+
+    async with ClientSession() as session:
+
+        async def post(update_id: int, update: dict):
+            async with semaphore:
+                update = {**update, "update_id": update_id}
+                async with session.post(args.url, json=update, headers=headers) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                post(n * len(updates) + i + 1, update)
+                for n in range(args.repeat)
+                for i, update in enumerate(updates)
+            )
+        )
+        elapsed = time.perf_counter() - started
+
+    total = sum(statuses.values())
+    print(f"{total} updates in {elapsed:.2f}s ({total / elapsed:.1f}/s), statuses: {statuses}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())